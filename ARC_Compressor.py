@@ -7,24 +7,30 @@ import os
 import sys
 import time
 from datetime import datetime, timedelta
-from os.path import relpath
+from itertools import islice
 from pathlib import Path
-from threading import Thread
 
 import requests
 import urllib3
 
 from app import models as db
+from app.calibrate import Calibration
+from app.capacity import Capacity
 from app.communication import Msg
-from app.insert import Insert
+from app.file_index import FileIndex
+from app.fetcher import ClipFetcher
+from app.lease import Heartbeat
 from app.params import Conf
-from app.transcode import Transcode
+from app.paths import resolver
+from app.pipeline import Pipeline
+from app.predictor import Predictor
 from extlib.logger import Logger
 from extlib import LegalPath
 from dateutil.relativedelta import relativedelta
 
 c = Conf()
 m = Msg(c)
+files_index = FileIndex(c)
 
 c.ScriptName = Path(__file__).stem
 
@@ -40,14 +46,14 @@ db.proxy.initialize(c.arc_compress)
 def excepthook(type_, value, traceback):
     import signal
     from traceback import format_exception
-    c.Q.put(-1)
     errmsg = ''.join(format_exception(type_, value, traceback))
     logging.error(errmsg)
     dtn = datetime.now().strftime('%d.%m.%Y_%H:%M')
     message = f'{dtn}\n--------------{c.ScriptName}--------------\n{errmsg}\n\n'
-    c.Q.put([{'END'}, 666])
     m.sendmail(message, 'ERROR')
     m.prepare_report()
+    # SIGTERM is a soft stop request of Control, here the process must really end
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
     os.kill(os.getpid(), signal.SIGTERM)
 
 
@@ -102,12 +108,12 @@ def restore_path(item):
             old_path = userpath.parent
             new_path = Path(LegalPath.make(path=str(old_path)))
 
-            if db.PathsBase.select().where(db.PathsBase.old_path == str(old_path)).exists():
+            if old_path in resolver:
                 logging.info(f'{userpath} Already in PathBase')
             else:
                 physics_path = physical_search_files(userpath, file_size)
                 if physics_path:
-                    db.PathsBase.create(old_path=str(old_path), physics_path=str(physics_path), new_path=str(new_path))
+                    resolver.add(old_path, physics_path, new_path)
                     logging.info(f'Path SUCCESSFUL restored\nold_path: {old_path}\n'
                                  f'physics_path: {physics_path}\nnew_path: {new_path}')
                     item['data']['video'][0]['file']['locations'] = []
@@ -117,32 +123,15 @@ def restore_path(item):
 
 
 def physical_search_files(userpath, file_size):
-    from glob import glob
-    path = Path(userpath)
-    file_name = path.name
-    while True:
-        if not c.MediaLocation.joinpath(path).exists() or str(path)[-1:] == '.':
-            path = path.parent
-        else:
-            break
     try:
-        list_of_files = glob(f'{c.MediaLocation.joinpath(path)}/**/{file_name}')
+        physics_path = files_index.find(userpath, file_size)
     except BaseException as e_:
-        logging.error(f'Can`t find files. glob.glob error: {repr(e_)}')
-        list_of_files = []
-    if len(list_of_files) == 0:
+        logging.error(f'Can`t find files. Index error: {repr(e_)}')
+        physics_path = None
+    if physics_path is None:
         logging.error('NO FILES Found !!!')
         return ''
-    if len(list_of_files) == 1:
-        path = Path(list_of_files[0])
-    else:
-        logging.warning(f'Found more then 1 file!!!\n{list_of_files}')
-        for file in list_of_files:
-            if abs(int(Path(file).stat().st_size) - file_size) < 10:
-                path = file
-                break
-    physics_path = Path(relpath(path, c.MediaLocation))
-    return physics_path.parent
+    return physics_path
 
 
 def es_copy_file(item, file_id, dst_file):
@@ -303,10 +292,40 @@ def es_search_files(date):
         clip_ids = [_['clip_id'] for _ in r.json()]
         logging.info(f'For less then {date} found {len(r.json())} files')
         clip_ids.sort()
-        return clip_ids[:c.LimitFiles], len(r.json())
+        return clip_ids, len(r.json())
+
+
+def build_search_results(backlog, predictor, budget=None, max_clips=None):
+    # takes clips from backlog iterator until budget (media seconds) or max_clips is reached.
+    # returns added media seconds and number of taken clips
+    def flush():
+        # one transaction per batch, rows become claimable all together
+        with db.proxy.atomic():
+            if report_rows:
+                db.ReportBase.insert_many(report_rows).execute()
+            if error_rows:
+                db.ErrorsBase.insert_many(error_rows).execute()
+        c.ItemLength += len(report_rows)
+        report_rows.clear()
+        error_rows.clear()
+
+    db.proxy.connection()
+    errors = {x.clip_id for x in db.ErrorsBase.select(db.ErrorsBase.clip_id)}
+    resolver.refresh()
+    report_rows, error_rows = list(), list()
+    seconds, taken = 0.0, 0
+    while (budget is None or seconds < budget) and not c.stop_service:
+        size = c.CatalogBatch if max_clips is None else min(c.CatalogBatch, max_clips - taken)
+        chunk = list(islice(backlog, size))
+        if not chunk:
+            break
+        taken += len(chunk)
+        seconds += add_clips(chunk, predictor, errors, report_rows, error_rows)
+        flush()
+    return seconds, taken
 
 
-def build_search_results(clip_ids):
+def add_clips(clip_ids, predictor, errors, report_rows, error_rows):
     def parse_duration(dur):
         dur_list = dur.split(':')
         try:
@@ -318,20 +337,12 @@ def build_search_results(clip_ids):
             dur = int(dur_list[0]) * 3600 + int(dur_list[1]) * 60 + int(dur_list[2]) + int(dur_list[3]) / fps
         return dur
 
-    db.proxy.connection()
-    for clip_id in clip_ids:
-        time.sleep(0.5)
-        try:
-            r = c.s_api.get(f'{c.srv_api}/clips/{clip_id}', timeout=5)
-            r.raise_for_status()
-        except BaseException as e__:
-            logging.error(f'Get cached search request error: {repr(e__)}')
-        else:
-            item = dict(clip_id=clip_id, data=r.json())
-            # print(r.json())
+    seconds = 0.0
+    for clip_id, data in ClipFetcher(c).fetch(clip_ids):
+        if data is not None:
+            item = dict(clip_id=clip_id, data=data)
 
-            if db.ErrorsBase.select().where(db.ErrorsBase.clip_id == item['clip_id']) or \
-                    'Offline' in item['data']['video'][0]['file']['status_text']:
+            if item['clip_id'] in errors or 'Offline' in item['data']['video'][0]['file']['status_text']:
                 pass
             else:
                 orig_size = int(item['data']['video'][0]['file']['file'].get('filesize', 0))
@@ -348,26 +359,30 @@ def build_search_results(clip_ids):
 
                 if len(json.dumps(item, indent=4, sort_keys=True, ensure_ascii=False).encode('utf-8')) >= 65535:
                     logging.critical(f'BIG DATA FOR clip_id={clip_id}')
-                    if not db.ErrorsBase.select().where(db.ErrorsBase.clip_id == clip_id):
-                        db.ErrorsBase.create(orig_size=orig_size, item={}, clip_id=clip_id, duration=duration,
-                                             userpath=userpath, captured=captured, problem='BIG DATA')
+                    errors.add(clip_id)
+                    error_rows.append(dict(item={}, clip_id=clip_id, userpath=userpath, problem='BIG DATA'))
                 else:
                     new_item, new_userpath, e1 = remove_wrong_paths(item)
+                    if not new_userpath:
+                        new_item, new_userpath, e2 = restore_path(item)
+                    predicted_size, predicted_time = predictor.predict(item, orig_size, duration)
+                    low_savings = predictor.low_savings(orig_size, predicted_size)
                     if new_userpath:
-                        db.ReportBase.create(orig_size=orig_size, item=new_item, clip_id=clip_id, duration=duration,
-                                             userpath=str(new_userpath), captured=captured)
+                        # skipped clip is not an error, the next catalog predicts it again
+                        skipped = low_savings and c.LowSavings == 'skip'
+                        if skipped:
+                            logging.info(f'clip_id={clip_id}. Predicted {predicted_size} of {orig_size}, skipped')
+                        report_rows.append(dict(orig_size=orig_size, item=new_item, clip_id=clip_id,
+                                                duration=duration, userpath=str(new_userpath), captured=captured,
+                                                predicted_size=predicted_size, predicted_time=predicted_time,
+                                                deferred=low_savings, skipped=skipped))
+                        if not skipped:
+                            seconds += duration
                     else:
-                        new_item, new_userpath, e2 = restore_path(item)
-                        if new_userpath:
-                            db.ReportBase.create(orig_size=orig_size, item=new_item, clip_id=clip_id, duration=duration,
-                                                 userpath=str(new_userpath), captured=captured)
-                        else:
-                            logging.critical(f'clip_id={clip_id}. No source files for all locations !!!')
-                            if not db.ErrorsBase.select().where(db.ErrorsBase.clip_id == clip_id):
-                                db.ErrorsBase.create(item=item, clip_id=clip_id,
-                                                     userpath=userpath,
-                                                     problem=f'{e1} {e2}')
-    return db.ReportBase.select().count()
+                        logging.critical(f'clip_id={clip_id}. No source files for all locations !!!')
+                        errors.add(clip_id)
+                        error_rows.append(dict(item=item, clip_id=clip_id, userpath=userpath, problem=f'{e1} {e2}'))
+    return seconds
 
 
 def change_table(field, value, table_name=None):
@@ -380,25 +395,27 @@ def change_table(field, value, table_name=None):
 def main(table_name: str, date: str):
     db.proxy.connection()
     host = m.get_hostname()
+    heartbeat = Heartbeat(c)
     if c.HELPER_MODE:
-        db.ReportBase._meta.table_name = table_name
-        query = db.ReportBase.select().where(~db.ReportBase.transcode |
-                                             ~db.ReportBase.clip_delete |
-                                             ~db.ReportBase.file_copy |
-                                             ~db.ReportBase.file_remove |
-                                             ~db.ReportBase.scan)
-        if query.exists():
+        db.update_sql_tables(table_name)
+        db.proxy.connection()
+        query = db.ReportBase.select().where(db.ReportBase.undone())
+        if query.exists() or not db.CatalogBase.is_complete(table_name, c.LeaseTime):
             c.ItemLength = db.ReportBase.select().count()
             message = f'HELPER MODE, AME={c.AME} on {host}\n' \
                       f'For {table_name} found {c.ItemLength} files\n{len(query)} UNDONE'
         else:
             return
     else:
+        # table and "catalog in progress" marker go first, helpers can wait for rows
+        db.create_sql_tables(table_name)
+        db.proxy.connection()
+        db.CatalogBase.start(table_name)
+        # helpers treat the catalog as abandoned when the marker is not renewed
+        heartbeat.start()
         clip_ids, results = es_search_files(date=date)
         # clip_ids, results = es_search_files(date='2022-08-12')
-        db.create_sql_tables(table_name)
-        c.ItemLength = build_search_results(clip_ids)
-        message = f'MAIN MODE on {host}\nFor less then {date} found {c.ItemLength} files'
+        message = f'MAIN MODE on {host}\nFor less then {date} found {results} files, {len(clip_ids)} in backlog'
 
     m.sendmail(message=message, subject='START')
     logging.info(message)
@@ -406,15 +423,38 @@ def main(table_name: str, date: str):
     # return
     db.proxy.close()
 
-    transcode_sub = Thread(target=Transcode, args=(c,))
-    insert_sub = Thread(target=Insert, args=(c,))
+    pipeline = Pipeline(c)
 
-    transcode_sub.start()
-    insert_sub.start()
+    if c.HELPER_MODE:
+        heartbeat.start()
+    pipeline.start()
+
+    if not c.HELPER_MODE:
+        # rows are claimable as soon as they are written. Batch follows measured throughput: while the window
+        # has room for more media than is pending, next clips are taken from the backlog
+        predictor, capacity = Predictor(c), Capacity(c)
+        backlog = iter(clip_ids)
+        try:
+            db.proxy.connection()
+            predictor.load(table_name)
+            capacity.load(table_name)
+            if capacity.room() is None:
+                # no throughput history yet
+                build_search_results(backlog, predictor, max_clips=c.LimitFiles)
+            else:
+                while not c.stop_service and capacity.seconds_left() > c.ClaimPoll:
+                    room = capacity.room()
+                    if room > 0 and not build_search_results(backlog, predictor, room)[1]:
+                        logging.info('Search backlog is empty')
+                        break
+                    time.sleep(c.ClaimPoll)
+        finally:
+            c.ItemLength = db.ReportBase.select().count()
+            db.CatalogBase.finish(table_name, c.ItemLength)
+        logging.info(f'Catalog for {table_name} complete, {c.ItemLength} files')
 
-    transcode_sub.join()
-    c.Q.put(-1)
-    insert_sub.join()
+    pipeline.join()
+    heartbeat.stop()
 
     db.proxy.close()
     time.sleep(10)
@@ -446,6 +486,9 @@ ap.add_argument("--main", default=False,
 ap.add_argument("--ame", default=False,
                 action='store_true', required=False,
                 help="Use Adobe Media Encoder to transcode problem files. Default False. If not installed set False")
+ap.add_argument("--calibrate", default=False,
+                action='store_true', required=False,
+                help="Encode samples of the last table with several x264 presets and save profile of this node.")
 try:
     args = vars(ap.parse_args())
 except BaseException as e:
@@ -473,6 +516,13 @@ current_table_name = datetime.strftime(datetime.now(), '%Y-%m-%d')
 if last_table_name == current_table_name:
     c.HELPER_MODE = True
 
+if args['calibrate']:
+    # samples are read with all columns of ReportBase, the table may predate them
+    db.update_sql_tables(last_table_name)
+    db.proxy.connection()
+    Calibration(c).run()
+    sys.exit(0)
+
 if c.HELPER_MODE:
     main(last_table_name, search_date)
 else:
@@ -1,5 +1,23 @@
+from .calibrate import *
+from .capacity import *
 from .communication import *
+from .control import *
+from .fetcher import *
+from .file_index import *
+from .fileops import *
 from .insert import *
+from .lease import *
 from .models import *
 from .params import *
+from .paths import *
+from .pipeline import *
+from .predictor import *
+from .priority import *
+from .probe import *
+from .progress import *
+from .resources import *
+from .scan_tracker import *
+from .scratch import *
+from .segment import *
+from .strategy import *
 from .transcode import *
@@ -0,0 +1,111 @@
+import logging
+import shlex
+import socket
+import subprocess
+import time
+from pathlib import Path
+
+from peewee import fn
+
+from . import models as db
+from .paths import resolver
+from .predictor import Predictor
+from .resources import node
+from .transcode import Transcode, VIDEO_TEMPLATE
+
+
+class Calibration:
+    # short samples of real clips are encoded with every preset of calibrate_presets. The fastest preset whose
+    # output is within calibrate_size_budget percents of the reference (medium) becomes the profile of this
+    # node for the source class
+    def __init__(self, c):
+        self.c = c
+        self.host = socket.gethostname()
+        self.work_dir = Path(c.MediaLocation, c.TempFolder, '.calibration')
+        node.configure(c)
+
+    def samples(self) -> dict:
+        # source class -> report ids of clips whose originals are still there
+        query = (db.ReportBase.select(db.ReportBase.id, db.ReportBase.item)
+                 .where(~db.ReportBase.file_remove & ~db.ReportBase.in_work &
+                        (db.ReportBase.duration > self.c.CalibrateSeconds * 3))
+                 .order_by(fn.RAND()))
+        result = dict()
+        for row in query:
+            ids = result.setdefault(Predictor.source_class(row.item), list())
+            if len(ids) < self.c.CalibrateSamples:
+                ids.append(row.id)
+        return result
+
+    def encode(self, input_file, start, preset):
+        # (seconds spent, output size) of one sample
+        out_file = Path(self.work_dir, '{}.mov'.format(preset))
+        encoder_string = '{} -hide_banner -loglevel error -ss {} -t {} -i {} -map 0:v:0 {}{} -an -y -f mov {}'.format(
+            self.c.ffm_path, start, self.c.CalibrateSeconds, shlex.quote(str(input_file)),
+            VIDEO_TEMPLATE.format(preset, self.c.Crf), node.threads_option(), shlex.quote(str(out_file)))
+        with node.slot() as n:
+            started = time.monotonic()
+            pr = subprocess.run(shlex.split(node.command(encoder_string, n)), capture_output=True,
+                                universal_newlines=True, timeout=self.c.CalibrateSeconds * 20)
+            spent = time.monotonic() - started
+        if pr.returncode or not out_file.exists():
+            logging.error('Calibration {} of {} FAILED: {}'.format(preset, input_file, pr.stderr))
+            return None
+        size = out_file.stat().st_size
+        out_file.unlink()
+        return spent, size
+
+    def measure(self, report_ids) -> dict:
+        # preset -> [x realtime, output size, source size] over all samples
+        totals = dict()  # preset -> [media seconds, seconds spent, output size, source size]
+        t = Transcode(self.c)
+        for report_id in report_ids:
+            t.load(report_id)
+            input_file = self.c.MediaLocation.joinpath(t.files()[0])
+            if not input_file.exists():
+                logging.warning('Calibration: no source {} for {}'.format(input_file, report_id))
+                continue
+            start = t.query.duration / 3
+            source_size = input_file.stat().st_size * self.c.CalibrateSeconds / t.query.duration
+            for preset in self.c.CalibratePresets:
+                sample = self.encode(input_file, start, preset)
+                if sample is None:
+                    continue
+                total = totals.setdefault(preset, [0, 0.0, 0, 0])
+                total[0] += self.c.CalibrateSeconds
+                total[1] += sample[0]
+                total[2] += sample[1]
+                total[3] += source_size
+        return {preset: [media / spent, size, source] for preset, (media, spent, size, source) in totals.items()}
+
+    def choose(self, results):
+        # fastest preset within the size budget of the reference
+        reference = results.get(self.c.CalibrateReference)
+        if reference is None:
+            return None
+        limit = reference[1] * (1 + self.c.CalibrateBudget / 100)
+        fit = [(speed, preset) for preset, (speed, size, source) in results.items() if size <= limit]
+        return max(fit)[1] if fit else self.c.CalibrateReference
+
+    def run(self):
+        db.ProfileBase.create_table()
+        # sources with restored paths are read from physics_path
+        resolver.refresh()
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        for source_class, report_ids in self.samples().items():
+            results = self.measure(report_ids)
+            for preset, (speed, size, source) in results.items():
+                logging.info('{} {}: {:.2f}x realtime, {} bytes'.format(source_class, preset, speed, size))
+            preset = self.choose(results)
+            if preset is None:
+                logging.warning('{}: no reference encode, profile is not changed'.format(source_class))
+                continue
+            speed, size, source = results[preset]
+            (db.ProfileBase.insert(host=self.host, source_class=source_class, preset=preset, crf=self.c.Crf,
+                                   speed=speed, ratio=size / source if source else 0, created=fn.NOW())
+             .on_conflict(update={db.ProfileBase.preset: preset, db.ProfileBase.crf: self.c.Crf,
+                                  db.ProfileBase.speed: speed,
+                                  db.ProfileBase.ratio: size / source if source else 0,
+                                  db.ProfileBase.created: fn.NOW()})
+             .execute())
+            logging.info('Profile for {} on {}: preset {}'.format(source_class, self.host, preset))
@@ -0,0 +1,68 @@
+import logging
+import time
+
+from peewee import fn
+
+from . import models as db
+from .predictor import DAY_TABLE
+from .priority import encoding, remaining_time, window_left
+from .resources import node
+
+
+class Capacity:
+    # how many seconds of media the farm can still encode tonight: measured throughput of recent runs
+    # (media seconds per hour per node) x nodes x time left in the window
+    def __init__(self, c):
+        self.c = c
+        self.rate = None
+        self.nodes = 1
+        self.deadline = time.time() + c.BatchHours * 3600
+
+    def load(self, current_table):
+        tables = sorted([x for x in db.proxy.get_tables() if DAY_TABLE.match(x) and x != current_table],
+                        reverse=True)[:self.c.PredictHistory]
+        media, active, hosts = 0.0, 0.0, list()
+        for table in tables:
+            columns = [x.name for x in db.proxy.get_columns(table)]
+            if 'owner' not in columns or 'claimed_at' not in columns:
+                continue
+            # claimed_at of the last clip of a host approximates its working time
+            sql = "SELECT SUBSTRING_INDEX(owner, ':', 1), SUM(duration), " \
+                  "TIMESTAMPDIFF(SECOND, MIN(claimed_at), MAX(claimed_at)) " \
+                  "FROM `{}` WHERE transcode AND claimed_at IS NOT NULL AND owner != '' " \
+                  "GROUP BY 1".format(table)
+            try:
+                rows = db.proxy.execute_sql(sql).fetchall()
+            except BaseException as e:
+                logging.warning('Can`t read throughput from {}: {}'.format(table, repr(e)))
+                continue
+            rows = [x for x in rows if x[2]]
+            if rows:
+                hosts.append(len(rows))
+                media += sum(float(x[1] or 0) for x in rows)
+                active += sum(float(x[2]) for x in rows)
+        if active:
+            self.rate = media / active * 3600
+            self.nodes = round(sum(hosts) / len(hosts))
+        now_nodes = (db.ReportBase.select(fn.COUNT(fn.DISTINCT(fn.SUBSTRING_INDEX(db.ReportBase.owner, ':', 1))))
+                     .where(db.ReportBase.lease_alive()).scalar() or 0)
+        self.nodes = max(self.nodes, now_nodes, 1)
+        logging.info('Capacity: {} media seconds per hour per node, {} nodes'.format(
+            None if self.rate is None else int(self.rate), self.nodes))
+
+    def seconds_left(self) -> float:
+        left = window_left(self.c)
+        return max(0.0, self.deadline - time.time()) if left is None else left
+
+    def room(self):
+        # media seconds still to add, None if throughput is unknown
+        if self.rate is None:
+            return None
+        rb = db.ReportBase
+        waiting = (rb.select(fn.SUM(rb.duration - rb.progress))
+                   .where(rb.undone() & ~rb.deferred & ~encoding()).scalar() or 0)
+        # running encode holds its slot for the time it still needs at the speed measured now,
+        # that time is counted as media one slot would encode meanwhile
+        running = rb.select(fn.SUM(remaining_time())).where(encoding()).scalar() or 0
+        pending = waiting + running * self.rate / node.slots / 3600
+        return self.rate * self.nodes * self.seconds_left() / 3600 - pending
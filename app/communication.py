@@ -32,7 +32,7 @@ class Msg:
         orig_size, dst_size = 0, 0
         db.proxy.connection()
         for i in range(6):
-            if db.ReportBase.select().where(db.ReportBase.in_work).exists() and not self.c.stop_service:
+            if db.ReportBase.select().where(db.ReportBase.lease_alive()).exists() and not self.c.stop_service:
                 time.sleep(600)
             else:
                 break
@@ -46,10 +46,13 @@ class Msg:
         file_copy_count = db.ReportBase.select().where(db.ReportBase.file_copy).count()
         file_remove_count = db.ReportBase.select().where(db.ReportBase.file_remove).count()
         scan_count = db.ReportBase.select().where(db.ReportBase.scan).count()
-        in_work_count = db.ReportBase.select().where(db.ReportBase.in_work).count()
+        in_work_count = db.ReportBase.select().where(db.ReportBase.lease_alive()).count()
+        skipped_count = db.ReportBase.select().where(db.ReportBase.skipped).count()
+        total = self.c.ItemLength - skipped_count
 
         msg = '{}\nFor Creation Date Less then {}:\n' \
               'Total {} files\n' \
+              'Skipped (low savings) {} files\n' \
               'In work {}\n' \
               'Not Transcoded {} files\n' \
               'Not Deleted {} clips\n' \
@@ -57,26 +60,23 @@ class Msg:
               'Not Moved {} files\n' \
               'Not Scanned {}\n' \
               'Saved space {}\nOriginal size {}\nTranscoded size {}'.format(host, db.ReportBase._meta.table_name,
-                                                                            self.c.ItemLength, in_work_count,
-                                                                            self.c.ItemLength - transcode_count,
-                                                                            self.c.ItemLength - clip_delete_count,
-                                                                            self.c.ItemLength - file_copy_count,
-                                                                            self.c.ItemLength - file_remove_count,
-                                                                            self.c.ItemLength - scan_count,
+                                                                            self.c.ItemLength, skipped_count,
+                                                                            in_work_count,
+                                                                            total - transcode_count,
+                                                                            total - clip_delete_count,
+                                                                            total - file_copy_count,
+                                                                            total - file_remove_count,
+                                                                            total - scan_count,
                                                                             saved_size,
                                                                             self.convert_size(orig_size),
                                                                             self.convert_size(dst_size))
-        if self.c.ItemLength == scan_count:
+        if total == scan_count:
             self.sendmail(message=msg, subject='DONE')
             logging.info(msg)
 
             return True
         else:
-            query = db.ReportBase.select().where(~db.ReportBase.transcode |
-                                                 ~db.ReportBase.clip_delete |
-                                                 ~db.ReportBase.file_copy |
-                                                 ~db.ReportBase.file_remove |
-                                                 ~db.ReportBase.scan)
+            query = db.ReportBase.select().where(db.ReportBase.undone())
             msg += '\n'
             for q in query:
                 userpath = q.userpath
@@ -0,0 +1,81 @@
+import json
+import logging
+import signal
+import socket
+import threading
+import time
+from pathlib import Path
+from threading import Thread, Event
+
+from . import models as db
+
+
+class Control(Thread):
+    # soft stop without restart: soft_stop.json (checked by mtime), a row of !_control_! for this host or '*',
+    # SIGTERM/SIGINT/SIGUSR1. Within control_poll_seconds claiming stops, queued items are released,
+    # running encodes finish (segmented ones checkpoint) and copy/delete/scan stages drain. Encodes still
+    # running stop_grace_seconds after the request are killed and their items released
+    def __init__(self, c):
+        super().__init__(daemon=True)
+        self.c = c
+        self.file = Path(c.ScriptPath, 'soft_stop.json')
+        self.mtime = None
+        self.host = socket.gethostname()
+        self.stopped = Event()
+        db.proxy.initialize(c.arc_compress)
+
+    def request(self, reason):
+        if not self.c.stop_service:
+            self.c.stop_time = time.monotonic()
+            self.c.stop_service = 1
+            logging.warning('Soft Stop requested by {}'.format(reason))
+
+    def read_file(self):
+        try:
+            mtime = self.file.stat().st_mtime
+        except FileNotFoundError:
+            json.dump({'stop_service': 0}, self.file.open('w'))
+            return
+        if mtime == self.mtime:
+            return
+        self.mtime = mtime
+        try:
+            value = json.load(self.file.open('r'))['stop_service']
+        except (KeyError, json.decoder.JSONDecodeError) as e:
+            logging.warning('Can`t read {}: {}'.format(self.file, repr(e)))
+            return
+        if value:
+            self.request(self.file.name)
+
+    def read_db(self):
+        with db.proxy.connection_context():
+            if db.ControlBase.requested(self.host):
+                self.request(db.ControlBase._meta.table_name)
+
+    def on_signal(self, signum, frame):
+        name = signal.Signals(signum).name
+        if self.c.stop_service and signum != getattr(signal, 'SIGUSR1', None):
+            # second stop signal, no more waiting
+            logging.warning('{} again, exit'.format(name))
+            signal.signal(signum, signal.SIG_DFL)
+            signal.raise_signal(signum)
+            return
+        self.request(name)
+
+    def install(self):
+        if threading.current_thread() is not threading.main_thread():
+            return
+        for name in ('SIGTERM', 'SIGINT', 'SIGUSR1'):
+            if hasattr(signal, name):
+                signal.signal(getattr(signal, name), self.on_signal)
+
+    def run(self):
+        while not self.stopped.wait(self.c.ControlPoll):
+            try:
+                self.read_file()
+                self.read_db()
+            except BaseException as e:
+                logging.error('Control check FAILED: {}'.format(repr(e)))
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,55 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+class RateLimiter:
+    def __init__(self, rps):
+        self.interval = 1 / rps if rps else 0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class ClipFetcher:
+    def __init__(self, c):
+        self.c = c
+        self.limiter = RateLimiter(c.ApiRps)
+
+    def get(self, clip_id):
+        url = f'{self.c.srv_api}/clips/{clip_id}'
+        for attempt in range(self.c.ApiRetries + 1):
+            self.limiter.wait()
+            try:
+                r = self.c.s_api.get(url, timeout=5)
+                r.raise_for_status()
+            except requests.HTTPError as e_:
+                # 4xx will not be better next time, except "Too Many Requests"
+                if e_.response.status_code != 429 and e_.response.status_code < 500:
+                    logging.error(f'Get clip_id={clip_id} error: {repr(e_)}')
+                    return None
+                error = e_
+            except BaseException as e_:
+                error = e_
+            else:
+                return r.json()
+            if attempt < self.c.ApiRetries:
+                time.sleep(2 ** attempt)
+        logging.error(f'Get clip_id={clip_id} error after {self.c.ApiRetries} retries: {repr(error)}')
+        return None
+
+    def fetch(self, clip_ids):
+        # results come back in clip_ids order, requests run concurrently
+        with ThreadPoolExecutor(max_workers=self.c.ApiWorkers) as pool:
+            for clip_id, data in zip(clip_ids, pool.map(self.get, clip_ids)):
+                yield clip_id, data
@@ -0,0 +1,113 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from pathlib import Path, PurePath
+
+
+class FileIndex:
+    # on-disk index of work_files_location: file name -> (dir, size).
+    # Directories with unchanged mtime are not listed again, so after the first build
+    # an update costs one stat per directory instead of a recursive glob per file
+    def __init__(self, c):
+        self.c = c
+        self.root = c.MediaLocation
+        self.db_file = Path(c.ScriptPath, c.FileIndex)
+        self.skip = {c.TempFolder}
+        self.updated = False
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_file)
+            self._conn.executescript(
+                'CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime REAL, subdirs TEXT);'
+                'CREATE TABLE IF NOT EXISTS files (name TEXT, dir TEXT, size INTEGER);'
+                'CREATE INDEX IF NOT EXISTS files_name ON files (name);'
+                'CREATE INDEX IF NOT EXISTS files_dir ON files (dir);')
+        return self._conn
+
+    def update(self):
+        start = time.monotonic()
+        known = {x[0]: (x[1], x[2]) for x in self.conn.execute('SELECT path, mtime, subdirs FROM dirs')}
+        seen, listed = set(), 0
+        stack = ['']
+        while stack:
+            rel = stack.pop()
+            seen.add(rel)
+            try:
+                mtime = os.stat(self.root.joinpath(rel)).st_mtime
+            except OSError as e:
+                logging.warning(f'Index: can`t stat {rel}: {repr(e)}')
+                continue
+            if rel in known and known[rel][0] == mtime:
+                stack.extend(json.loads(known[rel][1]))
+                continue
+            files, subdirs = list(), list()
+            try:
+                with os.scandir(self.root.joinpath(rel)) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if entry.name not in self.skip:
+                                    subdirs.append(os.path.join(rel, entry.name))
+                            elif entry.is_file(follow_symlinks=False):
+                                files.append((entry.name, rel, entry.stat(follow_symlinks=False).st_size))
+                        except OSError:
+                            pass
+            except OSError as e:
+                logging.warning(f'Index: can`t list {rel}: {repr(e)}')
+                continue
+            listed += 1
+            with self.conn:
+                self.conn.execute('DELETE FROM files WHERE dir = ?', (rel,))
+                self.conn.executemany('INSERT INTO files (name, dir, size) VALUES (?, ?, ?)', files)
+                self.conn.execute('INSERT OR REPLACE INTO dirs (path, mtime, subdirs) VALUES (?, ?, ?)',
+                                  (rel, mtime, json.dumps(subdirs)))
+            stack.extend(subdirs)
+        gone = [(x,) for x in known if x not in seen]
+        with self.conn:
+            self.conn.executemany('DELETE FROM dirs WHERE path = ?', gone)
+            self.conn.executemany('DELETE FROM files WHERE dir = ?', gone)
+        self.updated = True
+        logging.info(f'Index of {self.root} updated in {time.monotonic() - start:.0f} sec: '
+                     f'{len(seen)} dirs, {listed} listed again, {len(gone)} removed')
+
+    def nearest(self, userpath):
+        # nearest existing ancestor of the original location, relative to work_files_location
+        path = PurePath(userpath).parent
+        while path.parts and not self.root.joinpath(path).exists():
+            path = path.parent
+        return path.parts
+
+    def find(self, userpath, file_size=0):
+        # relative dir where the file physically lives, None if not found.
+        # Clip names repeat across the archive, so only a file with the right size
+        # or one under the nearest existing ancestor of userpath is accepted
+        if not self.updated:
+            self.update()
+        name = PurePath(userpath).name
+        wanted = PurePath(userpath).parent.parts
+        ancestor = self.nearest(userpath)
+        candidates = list()
+        for directory, size in self.conn.execute('SELECT dir, size FROM files WHERE name = ?', (name,)):
+            parts = PurePath(directory).parts
+            same_size = abs(size - file_size) < 10
+            # nothing of the original path left (ancestor is the root) - the size must match
+            if not same_size and not (ancestor and parts[:len(ancestor)] == ancestor):
+                continue
+            if not self.root.joinpath(directory, name).exists():
+                continue
+            common = 0
+            for a, b in zip(parts, wanted):
+                if a != b:
+                    break
+                common += 1
+            candidates.append((same_size, common, -len(parts), directory))
+        if len(candidates) > 1:
+            logging.warning(f'Found more then 1 file!!!\n{candidates}')
+        if not candidates:
+            return None
+        return Path(max(candidates)[-1])
@@ -0,0 +1,66 @@
+import errno
+import logging
+import os
+import shutil
+from pathlib import Path
+
+FICLONE = 0x40049409  # linux/fs.h
+
+
+def temp_name(path, tag='') -> Path:
+    # hidden name in the same directory, renamed into place when the file is complete.
+    # tag separates writers that may produce the same file at the same time
+    path = Path(path)
+    return path.with_name('.{}{}.part'.format(path.name, '.' + tag if tag else ''))
+
+
+def fast_copy(src, dst):
+    # reflink, then server-side copy_file_range (NFS 4.2, SMB3), then plain copy through the client
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            import fcntl
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return 'reflink'
+        except (ImportError, OSError):
+            pass
+        if hasattr(os, 'copy_file_range'):
+            try:
+                size = os.fstat(fsrc.fileno()).st_size
+                copied = 0
+                while copied < size:
+                    n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - copied)
+                    if n == 0:
+                        break
+                    copied += n
+                if copied == size:
+                    return 'copy_file_range'
+            except OSError:
+                pass
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+        shutil.copyfileobj(fsrc, fdst, 16 * 1024 * 1024)
+        return 'copy'
+
+
+def move_file(src, dst) -> str:
+    # dst never exists half-written: rename when possible, otherwise copy to hidden name and rename
+    src, dst = Path(src), Path(dst)
+    try:
+        os.replace(src, dst)
+        return 'rename'
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    tmp = temp_name(dst)
+    try:
+        method = fast_copy(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    try:
+        src.unlink()
+    except OSError as e:
+        logging.error('File Remove FAILED\n{}\n{}'.format(src, repr(e)))
+    return method
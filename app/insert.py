@@ -1,51 +1,62 @@
 import logging
 import os
-import shutil
 import time
 from datetime import datetime
 from pathlib import Path
 
 from . import models as db
+from .fileops import move_file, temp_name
+from .paths import resolver
 
 
 class Insert:
-    def __init__(self, c):
+    # copy, delete and scan stages of the pipeline, one object per stage worker
+    def __init__(self, c, tracker=None):
         self.c = c
+        self.tracker = tracker
+        self.i = 0
+        self.query = None
         db.proxy.initialize(c.arc_compress)
-        db.proxy.connection()
-        while True:
-            self.i = self.c.Q.get()
-            if self.i == -1:
-                break
-            self.query = db.ReportBase.get(db.ReportBase.id == self.i)
-            if self.query.clip_delete and self.query.file_copy and self.query.file_remove and self.query.scan:
-                self.query.in_work = False
-                self.query.save()
-            else:
-                logging.info('{}/{} Start Ingesting'.format(self.i, c.ItemLength))
-                try:
-                    self.query.file_remove = self.remove_original(check_mov=True)  # проверка если файл был .mov
-                    self.query.save()
-
-                    self.query.file_copy, self.query.dst_size = self.physical_copy_files(
-                        src_location=c.MediaLocation.joinpath(c.TempFolder),
-                        dst_location=c.MediaLocation)
-                    self.query.save()
-
-                    if self.query.file_copy:
-                        self.query.clip_delete = self.es_delete_clip()
-                        self.query.save()
-                        self.query.file_remove = self.remove_original()
-                        self.query.save()
-
-                        self.query.scan = self.es_scan_asset()
-                        self.query.save()
-                except BaseException as e:
-                    logging.error('INSERT THREAD PASSED WITH ERROR: {}'.format(repr(e)))
 
-                self.query.in_work = False
-                self.query.save()
-        db.proxy.close()
+    def load(self, i):
+        self.i = i
+        self.query = db.ReportBase.get(db.ReportBase.id == i)
+
+    def copy(self, i) -> bool:
+        self.load(i)
+        logging.info('{}/{} Start Ingesting'.format(self.i, self.c.ItemLength))
+        try:
+            self.query.file_remove = self.remove_original(check_mov=True)  # проверка если файл был .mov
+            self.query.save()
+
+            self.query.file_copy, self.query.dst_size = self.physical_copy_files(
+                src_location=self.c.MediaLocation.joinpath(self.c.TempFolder),
+                dst_location=self.c.MediaLocation)
+            self.query.save()
+        except BaseException as e:
+            logging.error('INSERT THREAD PASSED WITH ERROR: {}'.format(repr(e)))
+            return False
+        return self.query.file_copy
+
+    def delete(self, i) -> bool:
+        self.load(i)
+        try:
+            self.query.clip_delete = self.es_delete_clip()
+            self.query.save()
+            self.query.file_remove = self.remove_original()
+            self.query.save()
+        except BaseException as e:
+            logging.error('INSERT THREAD PASSED WITH ERROR: {}'.format(repr(e)))
+            return False
+        return True
+
+    def scan(self, i):
+        self.load(i)
+        try:
+            return self.es_scan_asset()
+        except BaseException as e:
+            logging.error('INSERT THREAD PASSED WITH ERROR: {}'.format(repr(e)))
+            return False
 
     def es_delete_clip(self) -> bool:
         if self.query.clip_delete:
@@ -78,12 +89,10 @@ class Insert:
             return True
         else:
             userpath = Path(self.query.userpath)
-            old_path = userpath.parent
-            if db.PathsBase.select().where(db.PathsBase.old_path == str(old_path)).exists():
-                physics_path = Path(
-                    db.PathsBase.select().where(db.PathsBase.old_path == str(old_path)).get().physics_path)
+            paths = resolver.get(userpath.parent)
+            if paths:
                 file_name = userpath.name
-                path_to_delete = self.c.MediaLocation.joinpath(physics_path, file_name)
+                path_to_delete = self.c.MediaLocation.joinpath(paths.physics_path, file_name)
             else:
                 path_to_delete = self.c.MediaLocation.joinpath(userpath)
 
@@ -106,56 +115,40 @@ class Insert:
         else:
             file_copy, dst_size = False, 0
             item_file_path = Path(self.query.userpath)
-            old_path = item_file_path.parent
+            paths = resolver.get(item_file_path.parent)
 
-            if db.PathsBase.select().where(db.PathsBase.old_path == str(old_path)).exists():
-                new_path = Path(db.PathsBase.get(db.PathsBase.old_path == str(old_path)).new_path)
+            if paths:
                 file_name = item_file_path.stem
-                item_file_path_with_ext = new_path.joinpath(file_name + '.mov')
+                item_file_path_with_ext = paths.new_path.joinpath(file_name + '.mov')
             else:
                 item_file_path_with_ext = item_file_path.parent.joinpath(item_file_path.stem + '.mov')
 
-            source = src_location.joinpath(item_file_path_with_ext)
             dst = dst_location.joinpath(item_file_path_with_ext)
+            if self.c.DirectOutput:
+                source = temp_name(dst)
+            else:
+                source = src_location.joinpath(item_file_path_with_ext)
 
             os.makedirs(dst.parent, exist_ok=True)
-            if dst.exists():
-                dst.unlink()
             try:
-                shutil.copyfile(source, dst)
+                method = move_file(source, dst)
             except BaseException as e:
                 logging.error('File Copy FAILED\n{}\nindex={}\n{}'.format(
                     self.c.MediaLocation.joinpath(source), self.i, repr(e)))
             else:
                 file_copy = True
                 dst_size = int(dst.stat().st_size)
-                logging.info('{}/{} Copied new file SUCCESS'.format(self.i, self.c.ItemLength))
-
-        if file_copy:
-            try:
-                source.unlink()
-            except BaseException as e:
-                logging.error(
-                    'File Remove FAILED\n{}\nindex={}\n{}'.format(self.c.MediaLocation.joinpath(source), self.i,
-                                                                  repr(e)))
-            else:
-                logging.info('{}/{} Removed temp file SUCCESS'.format(self.i, self.c.ItemLength))
+                logging.info('{}/{} Moved new file SUCCESS ({})'.format(self.i, self.c.ItemLength, method))
 
         return file_copy, dst_size
 
-    def es_scan_asset(self) -> bool:
+    def es_scan_asset(self):
+        # True - already scanned, None - submitted to tracker, False - failed
         if self.query.scan:
             return True
+        elif self.query.scan_id:
+            logging.info('{}/{} Scan {} already submitted'.format(self.i, self.c.ItemLength, self.query.scan_id))
         else:
-            if self.query.dst_size > 1000000000:
-                slp = 10
-            elif 500000000 < self.query.dst_size < 1000000000:
-                slp = 5
-            elif 100000000 < self.query.dst_size < 500000000:
-                slp = 3
-            else:
-                slp = 2
-
             metadata = self.es_build_meta()
             url = '{}/scan/asset'.format(self.c.srv_scan)
             try:
@@ -166,43 +159,17 @@ class Insert:
                     '{}/{} Scan Request FAILED\nmetadata: {}\n{}'.format(self.i, self.c.ItemLength,
                                                                          metadata['files'][0],
                                                                          repr(e)))
+                return False
             else:
-                time.sleep(1)
-                scan_id = r.json()[1:-1]
-                for j in range(100):
-                    time.sleep(slp)
-                    try:
-                        r = self.c.s_scan.get('{}/{}'.format(url, scan_id), timeout=60)
-                    except BaseException as e:
-                        logging.error(
-                            '{}/{} Scan get status FAILED. Error: {}'.format(self.i, self.c.ItemLength, repr(e)))
-                    else:
-                        time.sleep(1)
-                        data = r.json()
-                        state = data['state']
-                        if state == 'complete':
-                            logging.info('{}/{} Done Ingesting to location:\n{}'.format(self.i, self.c.ItemLength,
-                                                                                        self.c.MediaLocation.joinpath(
-                                                                                            metadata['files'][0])))
-                            return True
-                        elif state == 'failed':
-                            logging.error(
-                                '{}/{} Scan status FAILED\nmetadata: {}'.format(self.i, self.c.ItemLength,
-                                                                                metadata['files'][0]))
-                            logging.error(metadata)
-                            return False
-                        elif state in ['in progress', 'queued']:
-                            logging.info('Waiting for SCAN complete')
-                        else:
-                            logging.error(
-                                '{}/{} Scan UNKNOWN STATE\nState: {}'.format(self.i, self.c.ItemLength, state))
-                            return False
+                self.query.scan_id = r.json()[1:-1]
+                self.query.save()
+        self.tracker.add(self.i, self.query.scan_id, self.query.userpath)
 
     def es_build_meta(self) -> dict:
         item = self.query.item
-        old_path = Path(self.query.userpath).parent
-        if db.PathsBase.select().where(db.PathsBase.old_path == str(old_path)).exists():
-            new_path = Path(db.PathsBase.select().where(db.PathsBase.old_path == str(old_path)).get().new_path)
+        paths = resolver.get(Path(self.query.userpath).parent)
+        if paths:
+            new_path = paths.new_path
             file_name = new_path.stem
             new_file = str(new_path.joinpath(file_name + '.mov').as_posix())
         else:
@@ -0,0 +1,28 @@
+import logging
+from threading import Thread, Event
+
+from . import models as db
+
+
+class Heartbeat(Thread):
+    def __init__(self, c):
+        super().__init__(daemon=True)
+        self.c = c
+        self.stopped = Event()
+        db.proxy.initialize(c.arc_compress)
+
+    def run(self):
+        while not self.stopped.wait(self.c.LeaseTime / 3):
+            try:
+                with db.proxy.connection_context():
+                    number = db.ReportBase.renew(self.c.Owner, self.c.LeaseTime)
+                    number += db.SegmentBase.renew(self.c.Owner, self.c.LeaseTime)
+                    if not self.c.HELPER_MODE:
+                        db.CatalogBase.renew(db.ReportBase._meta.table_name)
+            except BaseException as e:
+                logging.error('Lease renew FAILED for {}: {}'.format(self.c.Owner, repr(e)))
+            else:
+                logging.debug('Lease renewed for {} rows of {}'.format(number, self.c.Owner))
+
+    def stop(self):
+        self.stopped.set()
@@ -1,4 +1,5 @@
 import json
+import uuid
 
 from peewee import *
 
@@ -21,11 +22,25 @@ class JSONField(TextField):
 
 class ReportBase(Model):
     in_work = BooleanField(default=False)
+    owner = TextField(default='')
+    claim_id = CharField(max_length=32, default='')
+    claimed_at = DateTimeField(null=True)
+    lease_until = DateTimeField(null=True)
+    attempts = IntegerField(default=0)
     transcode = BooleanField(default=False)
     clip_delete = BooleanField(default=False)
     file_copy = BooleanField(default=False)
     file_remove = BooleanField(default=False)
     scan = BooleanField(default=False)
+    scan_id = CharField(max_length=64, default='')
+    strategy = CharField(max_length=16, default='')
+    predicted_size = BigIntegerField(default=0)
+    predicted_time = FloatField(default=0.0)
+    deferred = BooleanField(default=False)  # low predicted savings, claimed after everything else
+    skipped = BooleanField(default=False)  # low predicted savings with low_savings_action "skip", never claimed
+    encode_time = FloatField(default=0.0)
+    progress = FloatField(default=0.0)  # encoded seconds of the running encode
+    speed = FloatField(default=0.0)  # x realtime
     item = JSONField(null=False)
     duration = FloatField(default=0.0)
     orig_size = IntegerField(default=0)
@@ -37,8 +52,56 @@ class ReportBase(Model):
     class Meta:
         database = proxy
         table_name = ''
+        only_save_dirty = True  # save() must not overwrite lease renewed by heartbeat
         # legacy_table_names = False
 
+    @classmethod
+    def undone(cls):
+        return ~cls.skipped & (~cls.transcode | ~cls.clip_delete | ~cls.file_copy | ~cls.file_remove | ~cls.scan)
+
+    @classmethod
+    def lease_expired(cls):
+        return cls.lease_until.is_null() | (cls.lease_until < fn.NOW())
+
+    @classmethod
+    def lease_alive(cls):
+        return cls.in_work & (cls.lease_until >= fn.NOW())
+
+    @classmethod
+    def claimable(cls, max_attempts=3):
+        return (~cls.in_work | cls.lease_expired()) & cls.undone() & (cls.attempts < max_attempts)
+
+    @classmethod
+    def claim(cls, owner, limit=1, max_attempts=3, lease=300, order=None, where=None) -> list:
+        # one UPDATE reserves the rows, so two workers can never get the same clip.
+        # rows of dead workers (lease expired) are claimable again
+        claim_id = uuid.uuid4().hex
+        order = order or [cls.deferred, cls.id]
+        claimable = cls.claimable(max_attempts)
+        if where is not None:
+            claimable &= where
+        number = (cls.update(in_work=True, owner=owner, claim_id=claim_id, claimed_at=fn.NOW(),
+                             lease_until=SQL('NOW() + INTERVAL %s SECOND', (lease,)),
+                             attempts=cls.attempts + 1)
+                  .where(claimable)
+                  .order_by(*order)
+                  .limit(limit)
+                  .execute())
+        if not number:
+            return []
+        return list(cls.select().where(cls.claim_id == claim_id).order_by(*order))
+
+    @classmethod
+    def release(cls, i) -> int:
+        # item was claimed but not processed (soft stop), the attempt is given back
+        return cls.update(in_work=False, attempts=cls.attempts - 1).where(cls.id == i).execute()
+
+    @classmethod
+    def renew(cls, owner, lease=300) -> int:
+        return (cls.update(lease_until=SQL('NOW() + INTERVAL %s SECOND', (lease,)))
+                .where(cls.in_work & (cls.owner == owner))
+                .execute())
+
 
 class ErrorsBase(Model):
     item = JSONField(null=False)
@@ -61,9 +124,160 @@ class PathsBase(Model):
         table_name = '!_paths_!'
 
 
+class CatalogBase(Model):
+    day_table = CharField(max_length=32, unique=True)
+    complete = BooleanField(default=False)
+    total = IntegerField(default=0)
+    started = DateTimeField(null=True)
+    finished = DateTimeField(null=True)
+    alive = DateTimeField(null=True)  # renewed by the heartbeat of main mode while the catalog is built
+
+    class Meta:
+        database = proxy
+        table_name = '!_catalog_!'
+
+    @classmethod
+    def start(cls, name):
+        cls.insert(day_table=name, started=fn.NOW(), alive=fn.NOW()).on_conflict(
+            update={cls.complete: False, cls.started: fn.NOW(), cls.alive: fn.NOW(), cls.finished: None}).execute()
+
+    @classmethod
+    def renew(cls, name) -> int:
+        return cls.update(alive=fn.NOW()).where((cls.day_table == name) & ~cls.complete).execute()
+
+    @classmethod
+    def finish(cls, name, total):
+        cls.update(complete=True, total=total, finished=fn.NOW()).where(cls.day_table == name).execute()
+
+    @classmethod
+    def is_complete(cls, name, lease=300) -> bool:
+        # tables built before the marker existed have no row and are complete.
+        # Main mode that died before finish() stops renewing the marker, after lease seconds
+        # the catalog is abandoned and treated as complete
+        query = cls.select().where(cls.day_table == name).first()
+        if query is None or query.complete:
+            return True
+        return (cls.select()
+                .where((cls.day_table == name) &
+                       (fn.COALESCE(cls.alive, cls.started) < SQL('NOW() - INTERVAL %s SECOND', (lease,))))
+                .exists())
+
+
+class ProbeBase(Model):
+    key = CharField(max_length=40, unique=True)  # sha1 of path
+    path = TextField(default='')
+    size = BigIntegerField(default=0)
+    mtime = DoubleField(default=0.0)
+    data = JSONField(null=False)
+
+    class Meta:
+        database = proxy
+        table_name = '!_probe_!'
+
+
+class SegmentBase(Model):
+    day_table = CharField(max_length=32)
+    report_id = IntegerField()
+    number = IntegerField(default=0)
+    kind = CharField(max_length=8, default='video')  # video or audio
+    start = DoubleField(default=0.0)
+    length = DoubleField(default=0.0)  # 0 - up to the end of source
+    source = TextField(default='')  # relative to work_files_location
+    output = TextField(default='')
+    options = TextField(default='')
+    status = CharField(max_length=8, default='new')  # new, work, done, failed
+    owner = TextField(default='')
+    claim_id = CharField(max_length=32, default='')
+    lease_until = DateTimeField(null=True)
+    attempts = IntegerField(default=0)
+
+    class Meta:
+        database = proxy
+        table_name = '!_segments_!'
+        indexes = ((('day_table', 'report_id', 'number'), True),)
+
+    @classmethod
+    def claim(cls, owner, day_table, report_id=None, max_attempts=3, lease=300):
+        claimable = ((cls.status == 'new') |
+                     ((cls.status == 'work') & (cls.lease_until.is_null() | (cls.lease_until < fn.NOW()))) |
+                     ((cls.status == 'failed') & (cls.attempts < max_attempts)))
+        where = (cls.day_table == day_table) & claimable
+        if report_id is not None:
+            where &= cls.report_id == report_id
+        claim_id = uuid.uuid4().hex
+        number = (cls.update(status='work', owner=owner, claim_id=claim_id,
+                             lease_until=SQL('NOW() + INTERVAL %s SECOND', (lease,)),
+                             attempts=cls.attempts + 1)
+                  .where(where)
+                  .order_by(cls.report_id, cls.number)
+                  .limit(1)
+                  .execute())
+        if not number:
+            return None
+        return cls.get_or_none(cls.claim_id == claim_id)
+
+    @classmethod
+    def renew(cls, owner, lease=300) -> int:
+        return (cls.update(lease_until=SQL('NOW() + INTERVAL %s SECOND', (lease,)))
+                .where((cls.status == 'work') & (cls.owner == owner))
+                .execute())
+
+
+class ProfileBase(Model):
+    # x264 settings chosen by calibration for a node and source class (ES video_codec + height)
+    host = CharField(max_length=64)
+    source_class = CharField(max_length=128)
+    preset = CharField(max_length=16, default='medium')
+    crf = IntegerField(default=22)
+    speed = FloatField(default=0.0)  # x realtime
+    ratio = FloatField(default=0.0)  # output / source size of the sample
+    created = DateTimeField(null=True)
+
+    class Meta:
+        database = proxy
+        table_name = '!_profiles_!'
+        indexes = ((('host', 'source_class'), True),)
+
+
+class ControlBase(Model):
+    # stop_service for one host or for all ('*'), read by running processes every few seconds
+    target = CharField(max_length=64, unique=True)
+    stop_service = IntegerField(default=0)
+    updated = DateTimeField(null=True)
+
+    class Meta:
+        database = proxy
+        table_name = '!_control_!'
+
+    @classmethod
+    def requested(cls, host) -> bool:
+        return cls.select().where(cls.target.in_(['*', host]) & (cls.stop_service != 0)).exists()
+
+
+def update_sql_tables(name):
+    # tables created before new columns were added to ReportBase
+    from playhouse.migrate import MySQLMigrator, migrate
+    with proxy:
+        ReportBase._meta.table_name = name
+        CatalogBase.create_table()
+        ProbeBase.create_table()
+        SegmentBase.create_table()
+        ProfileBase.create_table()
+        ControlBase.create_table()
+        columns = [x.name for x in proxy.get_columns(name)]
+        migrator = MySQLMigrator(proxy.obj)
+        migrate(*[migrator.add_column(name, field.column_name, field)
+                  for field in ReportBase._meta.sorted_fields if field.column_name not in columns])
+
+
 def create_sql_tables(name):
     with proxy:
         ReportBase._meta.table_name = name
         ReportBase.create_table()
         ErrorsBase.create_table()
         PathsBase.create_table()
+        CatalogBase.create_table()
+        ProbeBase.create_table()
+        SegmentBase.create_table()
+        ProfileBase.create_table()
+        ControlBase.create_table()
@@ -1,9 +1,9 @@
 import json
 import logging
 import os
+import socket
 import ssl
 import sys
-from multiprocessing import Queue
 from pathlib import Path
 
 import requests
@@ -13,8 +13,9 @@ from requests.adapters import HTTPAdapter, PoolManager
 
 
 class TlsAdapter(HTTPAdapter):
-    def init_poolmanager(self, *args, block=False):
-        self.poolmanager = PoolManager(*args, block=block, ssl_version=ssl.PROTOCOL_TLSv1)
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self.poolmanager = PoolManager(num_pools=connections, maxsize=maxsize, block=block,
+                                       ssl_version=ssl.PROTOCOL_TLSv1, **pool_kwargs)
 
 
 class Conf:
@@ -33,6 +34,68 @@ class Conf:
                 "scan_server_host": "https://10.2.0.30:12134",
                 "api_server_host": "https://10.2.0.20:12154",
                 "limit_files_number": 500,
+                "claim_batch_size": 1,
+                "max_attempts": 3,
+                "lease_seconds": 300,
+                "api_workers": 8,
+                "api_rps": 10,
+                "api_retries": 3,
+                "claim_poll_seconds": 15,
+                "catalog_batch_size": 50,
+                "file_index": "file_index.sqlite",
+                "segment_workers": 1,
+                "segment_min_duration": 0,
+                "segment_duration": 300,
+                "stage_workers": {"probe": 1, "encode": 1, "copy": 2, "delete": 2, "scan": 4},
+                "stage_queue_size": 2,
+                "scan_poll_seconds": 10,
+                "scan_timeout": 1800,
+                "direct_output": False,
+                "scratch_dir": "",
+                "scratch_budget_gb": 100,
+                "prefetch_count": 2,
+                "remux_codecs": ["h264", "hevc"],
+                "remux_audio_codecs": ["aac"],
+                "remux_codec_max_kbps": 25000,
+                "remux_any_max_kbps": 8000,
+                "predict_history_tables": 30,
+                "predict_bitrate_kbps": 12000,
+                "predict_speed": 1.0,
+                "min_savings_percent": 15,
+                "low_savings_action": "defer",
+                "schedule_policy": "savings",
+                "window_start": "",
+                "window_end": "",
+                "ingest_overhead_seconds": 120,
+                "ingest_mb_per_second": 100,
+                "sjf_before_end_minutes": 60,
+                "batch_window_hours": 8,
+                "encode_slots": 0,
+                "encode_threads": 4,
+                "encode_memory_gb": 2,
+                "cpu_affinity": False,
+                "encode_nice": 10,
+                "encode_ionice": 2,
+                "crf": 22,
+                "calibrate_presets": ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium"],
+                "calibrate_reference": "medium",
+                "calibrate_size_budget": 10,
+                "calibrate_seconds": 30,
+                "calibrate_samples": 2,
+                "stall_seconds": 120,
+                "max_time_factor": 4,
+                "progress_interval": 15,
+                "control_poll_seconds": 5,
+                "supervisor_url": "unix:///var/run/supervisor.sock",
+                "main_program": "main_mode",
+                "helper_program": "helper_mode",
+                "helper_delay_minutes": 2,
+                "helpers_min": 1,
+                "helpers_max": 8,
+                "items_per_helper": 20,
+                "load_high": 1.5,
+                "load_low": 0.8,
+                "scale_interval": 60,
                 "work_media_space": "ARCHIVE",
                 "work_files_location": "/mnt/ARCHIVE",
                 "temp_folder_name": "TEMP_TRANSFER"
@@ -67,6 +130,71 @@ class Conf:
             self.auth = (self.es_user, self.es_pass)
 
             self.LimitFiles = params['limit_files_number']
+            self.ClaimBatch = params.get('claim_batch_size', 1)
+            self.MaxAttempts = params.get('max_attempts', 3)
+            self.LeaseTime = params.get('lease_seconds', 300)
+            self.ApiWorkers = params.get('api_workers', 8)
+            self.ApiRps = params.get('api_rps', 10)
+            self.ApiRetries = params.get('api_retries', 3)
+            self.ClaimPoll = params.get('claim_poll_seconds', 15)
+            self.CatalogBatch = params.get('catalog_batch_size', 50)
+            self.FileIndex = params.get('file_index', 'file_index.sqlite')
+            self.SegmentWorkers = params.get('segment_workers', 1)
+            self.SegmentMinDuration = params.get('segment_min_duration', 0)  # 0 - never split
+            self.SegmentDuration = params.get('segment_duration', 300)
+            self.StageWorkers = params.get('stage_workers', dict())
+            self.StageQueue = params.get('stage_queue_size', 2)
+            self.ScanPoll = params.get('scan_poll_seconds', 10)
+            self.ScanTimeout = params.get('scan_timeout', 1800)
+            self.ScanWorkers = self.StageWorkers.get('scan', 1)
+            self.DirectOutput = params.get('direct_output', False)
+            self.ScratchDir = params.get('scratch_dir', '')
+            self.ScratchBudget = params.get('scratch_budget_gb', 100)
+            self.PrefetchCount = params.get('prefetch_count', 2)
+            self.RemuxCodecs = params.get('remux_codecs', ['h264', 'hevc'])
+            self.RemuxAudioCodecs = params.get('remux_audio_codecs', ['aac'])
+            self.RemuxCodecMaxRate = params.get('remux_codec_max_kbps', 25000)
+            self.RemuxAnyMaxRate = params.get('remux_any_max_kbps', 8000)
+            self.PredictHistory = params.get('predict_history_tables', 30)
+            self.PredictBitrate = params.get('predict_bitrate_kbps', 12000)
+            self.PredictSpeed = params.get('predict_speed', 1.0)
+            self.MinSavings = params.get('min_savings_percent', 15)
+            self.LowSavings = params.get('low_savings_action', 'defer')  # defer or skip
+            self.SchedulePolicy = params.get('schedule_policy', 'savings')  # id, savings, sjf, oldest
+            self.WindowStart = params.get('window_start', '')
+            self.WindowEnd = params.get('window_end', '')
+            self.IngestOverhead = params.get('ingest_overhead_seconds', 120)  # delete, scan and alike
+            self.IngestRate = params.get('ingest_mb_per_second', 100)
+            self.SjfBeforeEnd = params.get('sjf_before_end_minutes', 60)
+            self.BatchHours = params.get('batch_window_hours', 8)  # when window_end is not set
+            self.EncodeSlots = params.get('encode_slots', 0)  # 0 - from cores and memory
+            self.EncodeThreads = params.get('encode_threads', 4)
+            self.EncodeMemory = params.get('encode_memory_gb', 2)
+            self.CpuAffinity = params.get('cpu_affinity', False)
+            self.EncodeNice = params.get('encode_nice', 10)
+            self.EncodeIonice = params.get('encode_ionice', 2)  # io class, 0 - not used
+            self.Crf = params.get('crf', 22)
+            self.CalibratePresets = params.get('calibrate_presets',
+                                               ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium'])
+            self.CalibrateReference = params.get('calibrate_reference', 'medium')
+            self.CalibrateBudget = params.get('calibrate_size_budget', 10)  # percents over reference size
+            self.CalibrateSeconds = params.get('calibrate_seconds', 30)
+            self.CalibrateSamples = params.get('calibrate_samples', 2)
+            self.StallSeconds = params.get('stall_seconds', 120)
+            self.MaxTimeFactor = params.get('max_time_factor', 4)
+            self.ProgressInterval = params.get('progress_interval', 15)
+            self.ControlPoll = params.get('control_poll_seconds', 5)
+            self.StopGrace = params.get('stop_grace_seconds', 780)  # below stopwaitsecs of supervisord
+            self.SupervisorUrl = params.get('supervisor_url', 'unix:///var/run/supervisor.sock')
+            self.MainProgram = params.get('main_program', 'main_mode')
+            self.HelperProgram = params.get('helper_program', 'helper_mode')
+            self.HelperDelay = params.get('helper_delay_minutes', 2)
+            self.HelpersMin = params.get('helpers_min', 1)
+            self.HelpersMax = params.get('helpers_max', 8)  # not more than numprocs of helper_mode
+            self.ItemsPerHelper = params.get('items_per_helper', 20)
+            self.LoadHigh = params.get('load_high', 1.5)  # load average per core
+            self.LoadLow = params.get('load_low', 0.8)
+            self.ScaleInterval = params.get('scale_interval', 60)
             self.MS = params['work_media_space']
             self.AME_SRV = params['adobe_media_encoder_host']
             self.TempFolder = params['temp_folder_name']
@@ -88,8 +216,9 @@ class Conf:
                 thread_safe=True)
 
             self.stop_service = 0
-            self.Q = Queue()
+            self.stop_time = 0.0  # monotonic time of the soft stop request
             self.ItemLength = 0
+            self.Owner = f'{socket.gethostname()}:{os.getpid()}'
             self.PathData = list()
             self.ProblemList = list()
 
@@ -113,7 +242,7 @@ class Conf:
             self.s_api = requests.session()
             self.s_api.auth = self.auth
             self.s_api.verify = False
-            self.s_api.mount(self.srv_api, TlsAdapter())
+            self.s_api.mount(self.srv_api, TlsAdapter(pool_maxsize=self.ApiWorkers))
 
             self.HELPER_MODE = True
             self.AME = False
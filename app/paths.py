@@ -0,0 +1,39 @@
+import threading
+from collections import namedtuple
+from pathlib import Path
+
+from . import models as db
+
+PathRecord = namedtuple('PathRecord', ['physics_path', 'new_path'])
+
+
+class PathResolver:
+    # old_path -> (physics_path, new_path) from PathsBase, kept in memory.
+    # PathsBase row is always written before its ReportBase row, so refresh() right after a claim
+    # is enough to see paths of every claimed item
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.paths = dict()
+        self.last_id = 0
+
+    def __contains__(self, old_path):
+        return str(old_path) in self.paths
+
+    def refresh(self):
+        with self.lock:
+            query = db.PathsBase.select().where(db.PathsBase.id > self.last_id).order_by(db.PathsBase.id)
+            for row in query:
+                self.paths[row.old_path] = PathRecord(Path(row.physics_path), Path(row.new_path))
+                self.last_id = row.id
+
+    def get(self, old_path):
+        return self.paths.get(str(old_path))
+
+    def add(self, old_path, physics_path, new_path):
+        with self.lock:
+            row = db.PathsBase.create(old_path=str(old_path), physics_path=str(physics_path), new_path=str(new_path))
+            self.paths[row.old_path] = PathRecord(Path(physics_path), Path(new_path))
+        return row
+
+
+resolver = PathResolver()
@@ -0,0 +1,149 @@
+import logging
+import time
+from queue import Queue
+from threading import Thread
+
+from . import models as db
+from .control import Control
+from .insert import Insert
+from .paths import resolver
+from .priority import Scheduler, Window, window_left
+from .resources import node
+from .scan_tracker import ScanTracker
+from .scratch import Scratch
+from .segment import help_segments
+from .transcode import Transcode
+
+
+class Stage:
+    # pool of worker threads with a bounded inbox. Item id goes to the next stage when the handler
+    # returns True, None means the item is handed off (scan tracker), otherwise (or after the last stage)
+    # the item is released
+    def __init__(self, c, name, factory, next_stage=None, queue_size=None, drain=True, scratch=None):
+        self.c = c
+        self.name = name
+        self.drain = drain  # keep processing after soft stop
+        self.scratch = scratch  # local copies of the queued items, dropped when the item is released
+        self.factory = factory
+        self.next_stage = next_stage
+        self.workers = int(c.StageWorkers.get(name, 1))
+        self.queue = Queue(maxsize=queue_size or c.StageQueue)
+        self.threads = [Thread(target=self.worker, name=f'{name}_{n}') for n in range(self.workers)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.next_stage is not None:
+            self.next_stage.stop()
+
+    def worker(self):
+        handler = self.factory()
+        with db.proxy.connection_context():
+            while True:
+                i = self.queue.get()
+                if i is None:
+                    break
+                if self.c.stop_service and not self.drain:
+                    if self.scratch is not None:
+                        self.scratch.evict(i)
+                    db.ReportBase.release(i)
+                    continue
+                try:
+                    done = handler(i)
+                except BaseException as e:
+                    logging.error('{} STAGE PASSED WITH ERROR: {}'.format(self.name.upper(), repr(e)))
+                    done = False
+                if done is None:
+                    continue
+                if done and self.next_stage is not None:
+                    self.next_stage.queue.put(i)
+                else:
+                    db.ReportBase.update(in_work=False).where(db.ReportBase.id == i).execute()
+
+
+class Pipeline:
+    # claim -> probe -> [prefetch] -> encode -> copy -> delete -> scan. Every stage has own concurrency
+    # (stage_workers), bounded queues (stage_queue_size) between them keep claiming just ahead of encoding.
+    # With scratch_dir set, prefetch stage copies up to prefetch_count next sources to local disk.
+    # After soft stop (see Control) items waiting for probe/prefetch/encode are released, ingest stages drain
+    def __init__(self, c):
+        self.c = c
+        db.proxy.initialize(c.arc_compress)
+        node.configure(c)
+        self.tracker = ScanTracker(c)
+        self.scan = Stage(c, 'scan', lambda: Insert(c, self.tracker).scan)
+        self.delete = Stage(c, 'delete', lambda: Insert(c).delete, self.scan)
+        self.copy = Stage(c, 'copy', lambda: Insert(c).copy, self.delete)
+        self.scratch = Scratch(c)
+        if self.scratch.enabled:
+            self.encode = Stage(c, 'encode', lambda: Transcode(c, self.scratch).encode, self.copy,
+                                c.PrefetchCount, drain=False, scratch=self.scratch)
+            self.prefetch = Stage(c, 'prefetch', lambda: Transcode(c, self.scratch).prefetch, self.encode,
+                                  drain=False)
+            self.probe = Stage(c, 'probe', lambda: Transcode(c).probe_source, self.prefetch, drain=False)
+            self.stages = [self.probe, self.prefetch, self.encode, self.copy, self.delete, self.scan]
+        else:
+            self.encode = Stage(c, 'encode', lambda: Transcode(c).encode, self.copy, drain=False)
+            self.probe = Stage(c, 'probe', lambda: Transcode(c).probe_source, self.encode, drain=False)
+            self.stages = [self.probe, self.encode, self.copy, self.delete, self.scan]
+        self.scheduler = Scheduler(c)
+        self.window = Window(c)
+        self.control = Control(c)
+        self.claimer = Thread(target=self.claim, name='claim')
+
+    def start(self):
+        self.control.install()
+        self.control.read_file()
+        self.control.read_db()
+        self.control.start()
+        self.tracker.start()
+        for stage in self.stages:
+            stage.start()
+        self.claimer.start()
+
+    def join(self):
+        self.claimer.join()
+        self.probe.stop()
+        self.tracker.stop()
+        self.control.stop()
+        with db.proxy.connection_context():
+            false_count = db.ReportBase.select().where(~db.ReportBase.transcode & ~db.ReportBase.skipped).count()
+        if false_count:
+            logging.warning('Not all transcoded !!!! From {} fail {}'.format(self.c.ItemLength, false_count))
+        else:
+            logging.info('All {} transcoded'.format(self.c.ItemLength))
+
+    def claim(self):
+        with db.proxy.connection_context():
+            while not self.c.stop_service:
+                left = window_left(self.c)
+                if left == 0:
+                    logging.info('Processing window is closed, claiming stopped')
+                    break
+                batch = db.ReportBase.claim(self.c.Owner, self.c.ClaimBatch, self.c.MaxAttempts,
+                                             self.c.LeaseTime, self.scheduler.order(), self.window.fits(left))
+                if not batch:
+                    if self.window.segment_fits(left) and help_segments(self.c):
+                        continue
+                    if db.CatalogBase.is_complete(db.ReportBase._meta.table_name, self.c.LeaseTime):
+                        break
+                    # main mode is still building the catalog, new rows are coming
+                    time.sleep(self.c.ClaimPoll)
+                    continue
+                self.c.ItemLength = db.ReportBase.select().count()
+                resolver.refresh()
+                for query in batch:
+                    if self.c.stop_service:
+                        db.ReportBase.release(query.id)
+                    elif query.transcode:
+                        self.copy.queue.put(query.id)
+                    else:
+                        self.probe.queue.put(query.id)
+        if self.c.stop_service:
+            logging.info('Soft Stop! {} transcoded'.format(self.c.ItemLength))
@@ -0,0 +1,76 @@
+import logging
+import re
+
+from . import models as db
+
+DAY_TABLE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+class Predictor:
+    # expected output size and encode time of a clip before any CPU is spent on it. Ratios are learned per
+    # source class (ES video_codec + height) from transcoded rows of the last day tables
+    def __init__(self, c):
+        self.c = c
+        self.ratio = dict()  # class -> dst_size / orig_size
+        self.speed = dict()  # class -> seconds of media per second of encoding
+        self.default_ratio = None
+        self.default_speed = None
+
+    @staticmethod
+    def source_class(item) -> str:
+        video = item['data']['video'][0]
+        return '{}|{}'.format(video.get('video_codec', ''), video.get('height', 0))
+
+    def load(self, current_table):
+        tables = sorted([x for x in db.proxy.get_tables() if DAY_TABLE.match(x) and x != current_table],
+                        reverse=True)[:self.c.PredictHistory]
+        totals = dict()  # class -> [orig, dst, duration, encode_time]
+        for table in tables:
+            columns = [x.name for x in db.proxy.get_columns(table)]
+            encode_time = 'SUM(encode_time)' if 'encode_time' in columns else '0'
+            # remuxed rows say nothing about encoding
+            strategy = "AND strategy IN ('', 'encode') " if 'strategy' in columns else ''
+            sql = "SELECT JSON_UNQUOTE(JSON_EXTRACT(item, '$.data.video[0].video_codec')), " \
+                  "JSON_EXTRACT(item, '$.data.video[0].height'), " \
+                  "SUM(orig_size), SUM(dst_size), SUM(duration), {} " \
+                  "FROM `{}` WHERE transcode AND dst_size > 0 AND orig_size > 0 {}" \
+                  "GROUP BY 1, 2".format(encode_time, table, strategy)
+            try:
+                rows = db.proxy.execute_sql(sql).fetchall()
+            except BaseException as e:
+                logging.warning('Can`t read history from {}: {}'.format(table, repr(e)))
+                continue
+            for codec, height, orig, dst, duration, spent in rows:
+                total = totals.setdefault('{}|{}'.format(codec or '', height or 0), [0, 0, 0, 0])
+                for n, value in enumerate((orig, dst, duration, spent)):
+                    total[n] += float(value or 0)
+
+        for key, (orig, dst, duration, spent) in totals.items():
+            self.ratio[key] = dst / orig
+            if spent:
+                self.speed[key] = duration / spent
+        orig = sum(x[0] for x in totals.values())
+        if orig:
+            self.default_ratio = sum(x[1] for x in totals.values()) / orig
+        spent = sum(x[3] for x in totals.values() if x[3])
+        if spent:
+            self.default_speed = sum(x[2] for x in totals.values() if x[3]) / spent
+        logging.info('Predictor: {} source classes from {} day tables'.format(len(totals), len(tables)))
+
+    def predict(self, item, orig_size, duration):
+        # (predicted_size, predicted_time)
+        key = self.source_class(item)
+        ratio = self.ratio.get(key, self.default_ratio)
+        if ratio is None:
+            # no history at all, libx264 crf 22 bitrate scaled by frame size
+            video = item['data']['video'][0]
+            pixels = int(video.get('width') or 1920) * int(video.get('height') or 1080)
+            size = duration * self.c.PredictBitrate * 125 * pixels / (1920 * 1080)
+            ratio = min(1.0, size / orig_size) if orig_size else 1.0
+        speed = self.speed.get(key, self.default_speed) or self.c.PredictSpeed
+        return int(orig_size * ratio), duration / speed
+
+    def low_savings(self, orig_size, predicted_size) -> bool:
+        if not orig_size:
+            return False
+        return (orig_size - predicted_size) * 100 / orig_size < self.c.MinSavings
@@ -0,0 +1,134 @@
+import logging
+import time
+from datetime import datetime, timedelta
+
+from peewee import fn
+
+from . import models as db
+
+
+def at(now, hhmm) -> datetime:
+    hour, minute = [int(x) for x in hhmm.split(':')]
+    return now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+
+
+def window_left(c):
+    # seconds up to window_end ("HH:MM"), 0 outside of window_start..window_end, None without a window
+    if not c.WindowEnd:
+        return None
+    now = datetime.now()
+    end = at(now, c.WindowEnd)
+    if c.WindowStart:
+        start = at(now, c.WindowStart)
+        inside = start <= now < end if start < end else now >= start or now < end
+        if not inside:
+            return 0
+    if end <= now:
+        end += timedelta(days=1)
+    return (end - now).total_seconds()
+
+
+class Window:
+    # only items whose encode (duration / measured speed of the item or this host) and ingest fit in the time left are
+    # claimed, the end of the window is backfilled with short clips
+    def __init__(self, c):
+        self.c = c
+        self.host = c.Owner.split(':')[0]
+        self.speed = None
+        self.measured = 0
+
+    def node_speed(self):
+        # x realtime of full encodes made by this host in the current table, refreshed every 10 minutes
+        if time.monotonic() - self.measured > 600:
+            rb = db.ReportBase
+            self.speed = (rb.select(fn.SUM(rb.duration) / fn.SUM(rb.encode_time))
+                          .where(rb.owner.startswith(self.host + ':') & (rb.encode_time > 0) &
+                                 rb.strategy.in_(['', 'encode']))
+                          .scalar())
+            self.measured = time.monotonic()
+            if self.speed:
+                logging.info('Speed of {}: {:.2f}x realtime'.format(self.host, self.speed))
+        return self.speed
+
+    def fits(self, left):
+        # claim condition for the time left, None without a window
+        if left is None:
+            return None
+        rb = db.ReportBase
+        speed = self.node_speed()
+        # speed measured on the item itself beats the average of this host
+        encode = fn.IF(rb.speed > 0, remaining_time(), rb.duration / speed if speed else estimated_time())
+        ingest = self.c.IngestOverhead + fn.IF(rb.predicted_size > 0, rb.predicted_size, rb.orig_size) / (
+            self.c.IngestRate * 1024 ** 2)
+        # transcoded items need only ingest
+        return ((encode + ingest) <= left) | (rb.transcode & (ingest <= left))
+
+    def segment_fits(self, left) -> bool:
+        if left is None:
+            return True
+        return self.c.SegmentDuration / (self.node_speed() or 1) <= left
+
+
+def estimated_time():
+    rb = db.ReportBase
+    return fn.IF(rb.predicted_time > 0, rb.predicted_time, rb.duration)
+
+
+def encoding():
+    # rows with an encode running right now
+    rb = db.ReportBase
+    return rb.lease_alive() & ~rb.transcode & (rb.speed > 0)
+
+
+def remaining_time():
+    # wall seconds the encode still needs at its measured speed
+    rb = db.ReportBase
+    return fn.GREATEST(rb.duration - rb.progress, 0) / rb.speed
+
+
+def by_id():
+    return [db.ReportBase.id]
+
+
+def by_savings():
+    # bytes freed per estimated encode-second, rows without prediction fall back to bitrate of the source
+    rb = db.ReportBase
+    return [((rb.orig_size - rb.predicted_size) / fn.GREATEST(estimated_time(), 1)).desc(), rb.id]
+
+
+def by_shortest():
+    return [estimated_time(), db.ReportBase.id]
+
+
+def by_oldest():
+    return [db.ReportBase.captured, db.ReportBase.id]
+
+
+POLICIES = {
+    'id': by_id,
+    'savings': by_savings,
+    'sjf': by_shortest,
+    'oldest': by_oldest,
+}
+
+
+class Scheduler:
+    # ORDER BY of the claim query. Deferred (low savings) rows are always the last,
+    # close to window_end the policy switches to shortest job first, so the night ends with finished clips
+    def __init__(self, c):
+        self.c = c
+        if c.SchedulePolicy not in POLICIES:
+            logging.warning('Unknown schedule_policy {}, "id" is used'.format(c.SchedulePolicy))
+        self.policy = POLICIES.get(c.SchedulePolicy, by_id)
+        self.current = None
+
+    def order(self) -> list:
+        left = window_left(self.c)
+        if left is not None and left <= self.c.SjfBeforeEnd * 60:
+            policy = by_shortest
+        else:
+            policy = self.policy
+        if policy is not self.current:
+            logging.info('Claim order: {}'.format(policy.__name__))
+            self.current = policy
+        return [db.ReportBase.deferred] + policy()
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import logging
+import shlex
+import subprocess
+from pathlib import Path
+
+from . import models as db
+
+
+class Probe:
+    # one ffprobe per (path, size, mtime), result of a source is kept in ProbeBase and reused by all checks
+    # and next runs. Outputs (.part, TEMP, results) are probed once and kept in memory only
+    def __init__(self, c):
+        self.c = c
+        self.cache = dict()
+
+    def get(self, file, source=True) -> dict:
+        file = Path(file)
+        try:
+            stat = file.stat()
+        except OSError:
+            return {}
+        cache_key = (str(file), stat.st_size, stat.st_mtime)
+        if cache_key in self.cache:
+            return self.cache[cache_key]
+
+        if not source or not file.is_relative_to(self.c.MediaLocation):
+            # outputs and local scratch copies are not worth a row in ProbeBase
+            data = self.run(file)
+            if data:
+                self.cache[cache_key] = data
+            return data
+
+        key = hashlib.sha1(str(file).encode('utf-8')).hexdigest()
+        row = db.ProbeBase.get_or_none(db.ProbeBase.key == key)
+        if row is not None and row.size == stat.st_size and row.mtime == stat.st_mtime and row.data:
+            data = row.data
+        else:
+            data = self.run(file)
+            if data:
+                try:
+                    db.ProbeBase.insert(key=key, path=str(file), size=stat.st_size, mtime=stat.st_mtime,
+                                        data=data).on_conflict(
+                        update={db.ProbeBase.size: stat.st_size, db.ProbeBase.mtime: stat.st_mtime,
+                                db.ProbeBase.data: data}).execute()
+                except BaseException as e:
+                    logging.warning('Can`t save probe for {}: {}'.format(file, repr(e)))
+        if data:
+            self.cache[cache_key] = data
+        return data
+
+    def run(self, file) -> dict:
+        chk_string = '{} -v quiet -print_format json -show_streams -show_format {}'.format(self.c.ffp_path,
+                                                                                         shlex.quote(str(file)))
+        try:
+            p = subprocess.run(shlex.split(chk_string), capture_output=True)
+            data = json.loads(p.stdout)
+        except BaseException as e:
+            logging.error('Can`t probe {}: {}'.format(file, repr(e)))
+            return {}
+        else:
+            return data if data.get('streams') else {}
+
+    def streams(self, file, codec_type) -> list:
+        return [x for x in self.get(file).get('streams', list()) if x['codec_type'] == codec_type]
+
+    def duration(self, file, source=True) -> float:
+        # duration of the video stream. Only a source may fall back to the container duration,
+        # an output without a usable video stream must fail the length check
+        info = self.get(file, source)
+        video = [x for x in info.get('streams', list()) if x['codec_type'] == 'video']
+        if video and 'duration' in video[0]:
+            return float(video[0]['duration'])
+        if not source:
+            return 0.0
+        return float(info.get('format', dict()).get('duration', 0))
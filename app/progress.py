@@ -0,0 +1,90 @@
+import logging
+import subprocess
+import time
+from threading import Thread
+
+
+class FFmpeg:
+    # ffmpeg with machine readable -progress on stdout. The process is killed when its out_time stops moving
+    # for stall_seconds, or when it runs longer than max_time_factor x media duration (if known).
+    # After soft stop an encode gets stop_grace_seconds to finish, then it is killed as aborted
+    def __init__(self, c, args, duration, on_progress=None):
+        self.c = c
+        self.args = list(args)
+        self.duration = duration
+        self.on_progress = on_progress  # called from run() with (encoded seconds, speed) every progress_interval
+        self.position = 0.0
+        self.speed = 0.0
+        self.stalled = False
+        self.aborted = False
+        self.stderr = ''
+        self.returncode = None
+        self.moved = time.monotonic()
+
+    def command(self) -> list:
+        # -progress is a global option, right before the first input is fine
+        pos = self.args.index('-i') if '-i' in self.args else 1
+        return self.args[:pos] + ['-progress', 'pipe:1', '-nostats'] + self.args[pos:]
+
+    def parse(self, key, value):
+        if key == 'out_time_us' and value.isdigit():
+            position = int(value) / 1000000
+            if position > self.position:
+                self.position = position
+                self.moved = time.monotonic()
+        elif key == 'speed' and value.endswith('x'):
+            try:
+                self.speed = float(value[:-1])
+            except ValueError:
+                pass
+
+    def watchdog(self, process):
+        started = time.monotonic()
+        limit = max(self.duration, 60) * self.c.MaxTimeFactor if self.duration else None
+        while process.poll() is None:
+            now = time.monotonic()
+            if now - self.moved > self.c.StallSeconds:
+                logging.error('ffmpeg STALLED at {:.0f}s for {}s, killed'.format(self.position, self.c.StallSeconds))
+                self.stalled = True
+                process.kill()
+            elif limit is not None and now - started > limit:
+                logging.error('ffmpeg runs longer than {:.0f}s, killed'.format(limit))
+                self.stalled = True
+                process.kill()
+            elif self.c.stop_service and self.c.StopGrace and now - self.c.stop_time > self.c.StopGrace:
+                logging.warning('ffmpeg at {:.0f}s is not finished {}s after soft stop, killed'.format(
+                    self.position, self.c.StopGrace))
+                self.aborted = True
+                process.kill()
+            time.sleep(1)
+
+    def run(self) -> bool:
+        try:
+            process = subprocess.Popen(self.command(), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                       universal_newlines=True, errors='replace')
+        except OSError as e:
+            self.stderr = repr(e)
+            return False
+        errors = list()
+        reader = Thread(target=lambda: errors.extend(process.stderr), daemon=True)
+        watchdog = Thread(target=self.watchdog, args=(process,), daemon=True)
+        self.moved = time.monotonic()
+        reader.start()
+        watchdog.start()
+        reported = time.monotonic()
+        for line in process.stdout:
+            key, _, value = line.strip().partition('=')
+            self.parse(key, value)
+            # callback runs here, in the caller's thread that holds the DB connection
+            if key == 'progress' and self.on_progress is not None and \
+                    time.monotonic() - reported >= self.c.ProgressInterval:
+                reported = time.monotonic()
+                try:
+                    self.on_progress(self.position, self.speed)
+                except BaseException as e:
+                    logging.warning('Progress callback FAILED: {}'.format(repr(e)))
+        self.returncode = process.wait()
+        reader.join()
+        watchdog.join()
+        self.stderr = ''.join(errors)
+        return self.returncode == 0 and not self.stalled and not self.aborted
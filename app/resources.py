@@ -0,0 +1,113 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # windows, slots are counted inside the process only
+    fcntl = None
+
+
+def cpu_count() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def memory_gb() -> float:
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    return int(line.split()[1]) / 1024 ** 2
+    except OSError:
+        pass
+    return 0
+
+
+class NodeResources:
+    # encode slots shared by all processes of the node through lock files. Number of slots comes from
+    # cores / encode_threads and memory / encode_memory_gb unless encode_slots is set, every ffmpeg gets
+    # cores / slots threads, optionally pinned to its own cores and started with nice/ionice
+    def __init__(self):
+        self.c = None
+        self.lock = threading.Condition()
+        self.taken = set()
+        self.cores = cpu_count()
+        self.slots = 1
+        self.threads = self.cores
+        self.dir = Path(tempfile.gettempdir(), 'arc_compressor_slots')
+
+    def configure(self, c):
+        with self.lock:
+            if self.c is not None:
+                return
+            self.c = c
+            memory = memory_gb()
+            slots = c.EncodeSlots or max(1, self.cores // c.EncodeThreads)
+            if not c.EncodeSlots and memory and c.EncodeMemory:
+                slots = max(1, min(slots, int(memory // c.EncodeMemory)))
+            self.slots = slots
+            self.threads = max(1, self.cores // slots)
+            self.dir.mkdir(parents=True, exist_ok=True)
+        logging.info('Node: {} cores, {:.1f} GB, {} encode slots x {} threads'.format(
+            self.cores, memory, self.slots, self.threads))
+
+    def try_slot(self, n):
+        if n in self.taken:
+            return None
+        handle = open(Path(self.dir, 'slot_{}.lock'.format(n)), 'w')
+        if fcntl is not None:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                return None
+        self.taken.add(n)
+        return handle
+
+    @contextmanager
+    def slot(self):
+        while True:
+            with self.lock:
+                for n in range(self.slots):
+                    handle = self.try_slot(n)
+                    if handle is not None:
+                        break
+                else:
+                    handle = None
+                if handle is not None:
+                    break
+                self.lock.wait(1)
+        try:
+            yield n
+        finally:
+            with self.lock:
+                handle.close()  # closing releases flock
+                self.taken.discard(n)
+                self.lock.notify_all()
+
+    def threads_option(self) -> str:
+        return ' -threads {}'.format(self.threads) if self.c is not None else ''
+
+    def command(self, encoder_string, n) -> str:
+        if self.c is None:
+            return encoder_string
+        prefix = list()
+        if self.c.CpuAffinity and hasattr(os, 'sched_getaffinity') and shutil.which('taskset'):
+            cpus = sorted(os.sched_getaffinity(0))
+            own = cpus[n * self.threads:(n + 1) * self.threads] or cpus
+            prefix.append('taskset -c {}'.format(','.join(str(x) for x in own)))
+        if self.c.EncodeIonice and shutil.which('ionice'):
+            prefix.append('ionice -c {}'.format(self.c.EncodeIonice))
+        if self.c.EncodeNice and shutil.which('nice'):
+            prefix.append('nice -n {}'.format(self.c.EncodeNice))
+        return ' '.join(prefix + [encoder_string])
+
+
+node = NodeResources()
@@ -0,0 +1,66 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Event, Lock
+
+from . import models as db
+
+
+class ScanTracker(Thread):
+    # scans are submitted by the scan stage and polled here all together every scan_poll_seconds,
+    # so the stage is free for the next file while the scan server works
+    def __init__(self, c):
+        super().__init__(name='scan_tracker')
+        self.c = c
+        self.lock = Lock()
+        self.scans = dict()  # report id -> (scan_id, file, deadline)
+        self.stopped = Event()
+        db.proxy.initialize(c.arc_compress)
+
+    def add(self, i, scan_id, file):
+        with self.lock:
+            self.scans[i] = (scan_id, file, time.monotonic() + self.c.ScanTimeout)
+
+    def status(self, scan_id):
+        try:
+            r = self.c.s_scan.get('{}/scan/asset/{}'.format(self.c.srv_scan, scan_id), timeout=60)
+            r.raise_for_status()
+        except BaseException as e:
+            logging.error('Scan get status FAILED for {}. Error: {}'.format(scan_id, repr(e)))
+            return None
+        else:
+            return r.json()['state']
+
+    def poll(self):
+        with self.lock:
+            scans = list(self.scans.items())
+        if not scans:
+            return
+        with ThreadPoolExecutor(max_workers=self.c.ScanWorkers) as pool:
+            states = list(pool.map(lambda x: self.status(x[1][0]), scans))
+        for (i, (scan_id, file, deadline)), state in zip(scans, states):
+            if state == 'complete':
+                logging.info('{}/{} Done Ingesting to location:\n{}'.format(i, self.c.ItemLength, file))
+                db.ReportBase.update(scan=True, in_work=False).where(db.ReportBase.id == i).execute()
+            elif state in ['in progress', 'queued', None] and time.monotonic() < deadline:
+                continue
+            else:
+                logging.error('{}/{} Scan status {} for {}'.format(i, self.c.ItemLength,
+                                                                   state or 'TIMEOUT', file))
+                db.ReportBase.update(scan_id='', in_work=False).where(db.ReportBase.id == i).execute()
+            with self.lock:
+                del self.scans[i]
+
+    def run(self):
+        with db.proxy.connection_context():
+            while not (self.stopped.is_set() and not self.scans):
+                try:
+                    self.poll()
+                except BaseException as e:
+                    logging.error('SCAN TRACKER PASSED WITH ERROR: {}'.format(repr(e)))
+                time.sleep(self.c.ScanPoll)
+
+    def stop(self):
+        # wait for all outstanding scans
+        self.stopped.set()
+        self.join()
@@ -0,0 +1,75 @@
+import logging
+import os
+import shutil
+from pathlib import Path
+from threading import Condition
+
+from .fileops import fast_copy, temp_name
+
+
+class Scratch:
+    # local copies of the next sources, so ffmpeg reads from local disk instead of the EFS mount.
+    # Files are removed when the item leaves encode stage, staging waits while scratch_budget_gb is used
+    def __init__(self, c):
+        self.c = c
+        self.enabled = bool(c.ScratchDir)
+        self.root = Path(c.ScratchDir or '.', str(os.getpid()))
+        self.budget = int(c.ScratchBudget * 1024 ** 3)
+        self.staged = dict()  # report id -> (path, size)
+        self.used = 0
+        self.cv = Condition()
+        if self.enabled:
+            self.clean()
+            self.root.mkdir(parents=True, exist_ok=True)
+
+    def clean(self):
+        # leftovers of dead processes
+        for path in Path(self.c.ScratchDir).glob('*'):
+            if not path.name.isdigit():
+                continue
+            try:
+                os.kill(int(path.name), 0)
+            except ProcessLookupError:
+                shutil.rmtree(path, ignore_errors=True)
+                logging.info('Scratch {} removed'.format(path))
+            except OSError:
+                pass
+
+    def stage(self, i, source) -> bool:
+        size = source.stat().st_size
+        if size > self.budget:
+            return False
+        with self.cv:
+            self.cv.wait_for(lambda: self.used + size <= self.budget)
+            self.used += size
+        local = Path(self.root, str(i), source.name)
+        try:
+            local.parent.mkdir(parents=True, exist_ok=True)
+            fast_copy(source, temp_name(local))
+            os.replace(temp_name(local), local)
+        except BaseException as e:
+            logging.warning('Staging of {} FAILED: {}'.format(source, repr(e)))
+            shutil.rmtree(local.parent, ignore_errors=True)
+            with self.cv:
+                self.used -= size
+                self.cv.notify_all()
+            return False
+        with self.cv:
+            self.staged[i] = (local, size)
+        logging.info('{}/{} Staged to {}'.format(i, self.c.ItemLength, local))
+        return True
+
+    def get(self, i, source) -> Path:
+        staged = self.staged.get(i)
+        if staged and staged[0].name == Path(source).name:
+            return staged[0]
+        return source
+
+    def evict(self, i):
+        with self.cv:
+            staged = self.staged.pop(i, None)
+            if staged is None:
+                return
+            shutil.rmtree(staged[0].parent, ignore_errors=True)
+            self.used -= staged[1]
+            self.cv.notify_all()
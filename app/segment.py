@@ -0,0 +1,218 @@
+import json
+import logging
+import os
+import shlex
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePath
+
+from . import models as db
+from .fileops import temp_name
+from .progress import FFmpeg
+from .resources import node
+
+
+class SegmentEncoder:
+    # long sources are cut at keyframes, every video segment and the audio track become SegmentBase rows.
+    # Local workers and idle helpers on other nodes claim them, the owner of the item stream-copies
+    # the result into the final .mov
+    def __init__(self, c, i=0):
+        self.c = c
+        self.i = i
+        self.problem = []
+
+    def keyframe_after(self, file, t) -> float:
+        chk_string = '{} -v quiet -select_streams v:0 -show_entries packet=pts_time,flags -read_intervals {}%+10 ' \
+                     '-print_format json {}'.format(self.c.ffp_path, t, shlex.quote(str(file)))
+        try:
+            p = subprocess.run(shlex.split(chk_string), capture_output=True, timeout=60)
+            packets = json.loads(p.stdout).get('packets', list())
+        except BaseException as e:
+            logging.warning('Can`t read keyframes near {} for {}: {}'.format(t, file, repr(e)))
+            return t
+        for packet in packets:
+            if 'K' in packet.get('flags', '') and float(packet.get('pts_time', -1)) >= t:
+                return float(packet['pts_time'])
+        return t
+
+    def split_points(self, file, duration) -> list:
+        points = [0.0]
+        t = self.c.SegmentDuration
+        while t < duration - self.c.SegmentDuration / 2:
+            point = self.keyframe_after(file, t)
+            if point > points[-1]:
+                points.append(point)
+            t += self.c.SegmentDuration
+        return points
+
+    def run(self, encoder_string, duration) -> bool:
+        ff = FFmpeg(self.c, shlex.split(encoder_string), duration)
+        if not ff.run():
+            if ff.aborted:
+                return False
+            self.problem.append('Segment {}: {}'.format('STALLED' if ff.stalled else 'FAILED', ff.stderr))
+            return False
+        return True
+
+    def relative(self, path) -> str:
+        return PurePath(path).relative_to(self.c.MediaLocation).as_posix()
+
+    def manifest(self, input_file, video_options, audio_options) -> dict:
+        stat = input_file.stat()
+        return dict(source=self.relative(input_file), size=stat.st_size, mtime=stat.st_mtime,
+                    video_options=video_options, audio_options=audio_options,
+                    segment_duration=self.c.SegmentDuration)
+
+    def register(self, input_file, work_dir, video_options, audio_options, duration, report_id):
+        # work_dir keeps finished segments and the manifest they were made with. When the manifest still
+        # matches the source and options, the encode resumes: existing segments are registered as done
+        day_table = db.ReportBase._meta.table_name
+        manifest_file = Path(work_dir, 'manifest.json')
+        manifest = self.manifest(input_file, video_options, audio_options)
+        try:
+            saved = json.loads(manifest_file.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            saved = dict()
+        resume = bool(saved.get('points')) and all(saved.get(k) == v for k, v in manifest.items())
+        if resume:
+            points = saved['points']
+        else:
+            for stale in work_dir.iterdir():
+                stale.unlink()
+            points = self.split_points(input_file, duration)
+            manifest['points'] = points
+            manifest_file.write_text(json.dumps(manifest, indent=4), encoding='utf-8')
+        rows = list()
+        for n, start in enumerate(points):
+            rows.append(dict(day_table=day_table, report_id=report_id, number=n, kind='video', start=start,
+                             length=points[n + 1] - start if n + 1 < len(points) else 0,
+                             source=self.relative(input_file),
+                             output=self.relative(Path(work_dir, 'seg_{:04d}.mov'.format(n))),
+                             options=video_options))
+        if audio_options:
+            rows.append(dict(day_table=day_table, report_id=report_id, number=len(points), kind='audio',
+                             source=self.relative(input_file), output=self.relative(Path(work_dir, 'audio.mov')),
+                             options=audio_options))
+        if resume:
+            # a segment file appears only after its encode finished
+            for row in rows:
+                row['status'] = 'done' if self.c.MediaLocation.joinpath(row['output']).exists() else 'new'
+            logging.info('{}/{} Resumed: {} of {} segments already encoded'.format(
+                self.i, self.c.ItemLength, len([x for x in rows if x['status'] == 'done']), len(rows)))
+        with db.proxy.atomic():
+            db.SegmentBase.delete().where((db.SegmentBase.day_table == day_table) &
+                                          (db.SegmentBase.report_id == report_id)).execute()
+            db.SegmentBase.insert_many(rows).execute()
+        return rows
+
+    def encode_segment(self, segment) -> bool:
+        input_file = self.c.MediaLocation.joinpath(segment.source)
+        result = self.c.MediaLocation.joinpath(segment.output)
+        # an expired lease can give the segment to another node while this one still encodes it
+        output = temp_name(result, segment.claim_id)
+        if segment.kind == 'audio':
+            encoder_string = '{} -hide_banner -loglevel error -i {} -vn {} -y -f mov {}'.format(
+                self.c.ffm_path, shlex.quote(str(input_file)), segment.options, shlex.quote(str(output)))
+        else:
+            encoder_string = '{} -hide_banner -loglevel error -vsync 0 -ss {} -i {} {}-map 0:v:0 {} ' \
+                             '-an -y -f mov {}'.format(self.c.ffm_path, segment.start, shlex.quote(str(input_file)),
+                                                       '-t {} '.format(segment.length) if segment.length else '',
+                                                       segment.options + node.threads_option(),
+                                                       shlex.quote(str(output)))
+        with node.slot() as n:
+            logging.info('Segment {} of item {} from {} started'.format(segment.number, segment.report_id,
+                                                                      segment.day_table))
+            # audio track has no length, only stalls are watched
+            done = self.run(node.command(encoder_string, n), segment.length)
+        if done:
+            os.replace(output, result)
+            status = dict(status='done')
+        else:
+            output.unlink(missing_ok=True)
+            # interrupted by soft stop: the segment waits for the next run, the attempt is given back
+            status = dict(status='new', attempts=db.SegmentBase.attempts - 1) if self.c.stop_service else \
+                dict(status='failed')
+        db.SegmentBase.update(**status).where(
+            (db.SegmentBase.id == segment.id) & (db.SegmentBase.claim_id == segment.claim_id)).execute()
+        return done
+
+    def state(self, report_id) -> str:
+        segments = db.SegmentBase.select().where((db.SegmentBase.day_table == db.ReportBase._meta.table_name) &
+                                                 (db.SegmentBase.report_id == report_id))
+        if any(x.status == 'failed' and x.attempts >= self.c.MaxAttempts for x in segments):
+            return 'failed'
+        if all(x.status == 'done' for x in segments):
+            return 'done'
+        return 'wait'
+
+    def work(self, report_id) -> str:
+        # encode segments of this item until all are done; segments taken by other nodes are awaited,
+        # their expired leases make them claimable here again
+        with db.proxy.connection_context():
+            while True:
+                if self.c.stop_service:
+                    # running segments are finished, the rest waits in work_dir for the next run
+                    return 'stopped'
+                segment = db.SegmentBase.claim(self.c.Owner, db.ReportBase._meta.table_name, report_id,
+                                               self.c.MaxAttempts, self.c.LeaseTime)
+                if segment is not None:
+                    self.encode_segment(segment)
+                    continue
+                state = self.state(report_id)
+                if state != 'wait':
+                    return state
+                time.sleep(self.c.ClaimPoll)
+
+    def concat(self, work_dir, rows, audio_options, tc, c_time, out_file) -> str:
+        # video segments in order of their numbers are stream-copied into the result, audio track is added
+        segments = [Path(x['output']).name for x in sorted(rows, key=lambda x: x['number']) if x['kind'] == 'video']
+        concat_list = Path(work_dir, 'concat.txt')
+        concat_list.write_text(''.join("file '{}'\n".format(x) for x in segments), encoding='utf-8')
+        audio_file = Path(work_dir, 'audio.mov')
+        return '{} -hide_banner -loglevel error -f concat -safe 0 -i {} {}-map 0:v {}-c copy ' \
+               '-write_tmcd 1 -gop_timecode {} -metadata creation_time={} -metadata timecode={} ' \
+               '-y -f mov {}'.format(self.c.ffm_path, shlex.quote(str(concat_list)),
+                                     '-i {} '.format(shlex.quote(str(audio_file))) if audio_options else '',
+                                     '-map 1:a ' if audio_options else '',
+                                     shlex.quote(tc), shlex.quote(c_time), shlex.quote(tc),
+                                     shlex.quote(str(out_file)))
+
+    def encode(self, input_file, out_file, video_options, audio_options, tc, c_time, duration, report_id) -> bool:
+        work_dir = Path(out_file.parent, '.{}.segments'.format(out_file.stem))
+        work_dir.mkdir(parents=True, exist_ok=True)
+        rows = self.register(input_file, work_dir, video_options, audio_options, duration, report_id)
+        logging.info('{}/{} Segmented encoding: {} jobs, {} local workers'.format(
+            self.i, self.c.ItemLength, len(rows), self.c.SegmentWorkers))
+
+        with ThreadPoolExecutor(max_workers=self.c.SegmentWorkers) as pool:
+            states = list(pool.map(self.work, [report_id] * self.c.SegmentWorkers))
+        try:
+            if 'failed' in states:
+                logging.error('{}/{} Segmented encoding FAILED'.format(self.i, self.c.ItemLength))
+                return False
+            if 'stopped' in states:
+                logging.info('{}/{} Segmented encoding stopped, finished segments are kept in {}'.format(
+                    self.i, self.c.ItemLength, work_dir))
+                return False
+
+            encoder_string = self.concat(work_dir, rows, audio_options, tc, c_time, out_file)
+            if not self.run(encoder_string, duration):
+                logging.error('{}/{} Segments concat FAILED'.format(self.i, self.c.ItemLength))
+                return False
+            shutil.rmtree(work_dir, ignore_errors=True)
+            return True
+        finally:
+            # rows are registered again on resume, helpers must not encode segments of a stopped item
+            db.SegmentBase.delete().where((db.SegmentBase.day_table == db.ReportBase._meta.table_name) &
+                                          (db.SegmentBase.report_id == report_id)).execute()
+
+
+def help_segments(c) -> bool:
+    # idle worker takes one segment of any item from the current table
+    segment = db.SegmentBase.claim(c.Owner, db.ReportBase._meta.table_name, None, c.MaxAttempts, c.LeaseTime)
+    if segment is None:
+        return False
+    SegmentEncoder(c, segment.report_id).encode_segment(segment)
+    return True
@@ -0,0 +1,52 @@
+import logging
+
+ENCODE = 'encode'
+AUDIO = 'audio'
+REMUX = 'remux'
+
+
+class Strategy:
+    # what ffmpeg has to do with the source: 'remux' - stream copy into .mov, 'audio' - copy video and
+    # transcode audio only, 'encode' - full libx264 encode
+    def __init__(self, c, probe):
+        self.c = c
+        self.probe = probe
+
+    def bitrate(self, file, stream) -> int:
+        # kbps, video stream bitrate if container knows it, else overall
+        for value in (stream.get('bit_rate'), self.probe.get(file).get('format', dict()).get('bit_rate')):
+            try:
+                return int(value) // 1000
+            except (TypeError, ValueError):
+                continue
+        return 0
+
+    def copy_video(self, file) -> bool:
+        video = self.probe.streams(file, 'video')
+        if len(video) != 1:
+            return False
+        stream = video[0]
+        codec = stream.get('codec_name', '')
+        profile = stream.get('profile', '')
+        bitrate = self.bitrate(file, stream)
+        if codec in self.c.RemuxCodecs and 'Intra' not in profile:
+            # long GOP AVC/HEVC is already compact, unless its bitrate says otherwise (XAVC and alike)
+            return not self.c.RemuxCodecMaxRate or 0 < bitrate <= self.c.RemuxCodecMaxRate
+        return bool(self.c.RemuxAnyMaxRate) and 0 < bitrate <= self.c.RemuxAnyMaxRate
+
+    def copy_audio(self, file) -> bool:
+        audio = self.probe.streams(file, 'audio')
+        if not audio:
+            return True
+        if len(audio) == 4:
+            layout_ok = all(x.get('channels') == 1 for x in audio)
+        else:
+            layout_ok = len(audio) == 1 and audio[0].get('channels', 0) <= 2
+        return layout_ok and all(x.get('codec_name') in self.c.RemuxAudioCodecs for x in audio)
+
+    def decide(self, file) -> str:
+        if not self.probe.get(file) or not self.copy_video(file):
+            return ENCODE
+        result = REMUX if self.copy_audio(file) else AUDIO
+        logging.debug('{} {}'.format(result, file))
+        return result
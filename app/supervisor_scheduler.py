@@ -1,63 +1,205 @@
+import http.client
 import logging
-import shlex
-import time
-from datetime import datetime
-from subprocess import Popen, STDOUT, PIPE
-
-
-def is_running(name) -> bool:
-    p = Popen(shlex.split(f'supervisorctl status {name}'), stdout=PIPE, stderr=STDOUT)
-    stdout, stderr = p.communicate(timeout=30)
-    return True if 'running' in stdout.decode().lower() else False
-
-
-def start(name) -> bool:
-    p = Popen(shlex.split(f'supervisorctl start {name}'), stdout=PIPE, stderr=STDOUT)
-    stdout, stderr = p.communicate(timeout=30)
-    return True if 'started' in stdout.decode().lower() else False
-
-
-def scheduler():
-    global main_started, helper_started
-    now = datetime.now()
-
-    if now.hour == start_hour and now.minute in range(0, 5):
-        name = Services['main']
-        if not main_started:
-            if start(name):
-                main_started = True
-                logging.info(f"{name} started successful")
-            else:
-                logging.error(f"{name} is not started")
-                time.sleep(60)
-    else:
-        main_started = False
-
-    if now.hour == start_hour and now.minute in range(30, 35):
-        if not helper_started:
-            s = dict()
-            for i in range(Services['nprocs']):
-                name = f"{Services['helper']}:{i:02d}"
-                if start(name):
-                    s['action'] = True
-                    logging.info(f"{name} started successful")
-                else:
-                    logging.error(f"{name} is not started")
-                    time.sleep(60)
-            if False not in s:
-                helper_started = True
-            else:
-                logging.error(f"Not all actions started: {s}")
-    else:
-        helper_started = False
-
-
-main_started = False
-helper_started = False
-start_hour = 22
-
-Services = dict(main='main_mode', helper='helper_mode', nprocs=4)
-
-while True:
-    scheduler()
-    time.sleep(10)
+import math
+import os
+import signal
+import socket
+import sys
+import xmlrpc.client
+from datetime import datetime, timedelta
+from pathlib import Path
+from threading import Event
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app import models as db  # noqa: E402
+from app.params import Conf  # noqa: E402
+from app.predictor import DAY_TABLE  # noqa: E402
+from app.priority import at, window_left  # noqa: E402
+
+
+class UnixStreamHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=30):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class UnixStreamTransport(xmlrpc.client.Transport):
+    # supervisord listens on a unix socket by default (unix_http_server)
+    def __init__(self, path):
+        super().__init__()
+        self.socket_path = path
+
+    def make_connection(self, host):
+        return UnixStreamHTTPConnection(self.socket_path)
+
+
+def connect(url) -> xmlrpc.client.ServerProxy:
+    # unix:///var/run/supervisor.sock or http://127.0.0.1:9001/RPC2
+    if url.startswith('unix://'):
+        return xmlrpc.client.ServerProxy('http://localhost/RPC2', transport=UnixStreamTransport(url[7:]))
+    return xmlrpc.client.ServerProxy(url)
+
+
+class Supervisor:
+    def __init__(self, rpc):
+        self.rpc = rpc
+
+    def processes(self, group) -> dict:
+        return {f"{x['group']}:{x['name']}": x['statename']
+                for x in self.rpc.supervisor.getAllProcessInfo() if x['group'] == group}
+
+    def running(self, group) -> list:
+        return sorted(k for k, v in self.processes(group).items() if v in ('RUNNING', 'STARTING'))
+
+    def stopped(self, group) -> list:
+        return sorted(k for k, v in self.processes(group).items() if v not in ('RUNNING', 'STARTING', 'STOPPING'))
+
+    def start(self, name) -> bool:
+        try:
+            return bool(self.rpc.supervisor.startProcess(name, False))
+        except xmlrpc.client.Fault as e:
+            if 'ALREADY_STARTED' in e.faultString:
+                return True
+            logging.error(f'{name} is not started: {e.faultString}')
+            return False
+
+    def drain(self, name) -> bool:
+        # USR1 is soft stop of ARC_Compressor: no new claims, running encodes are finished
+        try:
+            return bool(self.rpc.supervisor.signalProcess(name, 'USR1'))
+        except xmlrpc.client.Fault as e:
+            logging.error(f'{name} is not signalled: {e.faultString}')
+            return False
+
+
+def next_fire(hhmm, now, grace=timedelta(0)) -> datetime:
+    # next time of day "HH:MM" not earlier than now - grace
+    fire = at(now, hhmm)
+    if fire < now - grace:
+        fire += timedelta(days=1)
+    return fire
+
+
+def helpers_wanted(depth, running, load, c) -> int:
+    # helper count for queue depth (claimable items) and node load (load average per core). A short queue
+    # never drains helpers: main mode may still be writing the catalog, and helpers exit by themselves
+    # when the table is done. Only overload drains them, one per call
+    if load > c.LoadHigh:
+        return max(running - 1, c.HelpersMin)
+    if depth is None or load > c.LoadLow:
+        return max(running, c.HelpersMin)
+    wanted = min(c.HelpersMax, max(c.HelpersMin, math.ceil(depth / c.ItemsPerHelper)))
+    return max(wanted, running)
+
+
+def queue_depth(c):
+    # claimable items of the last day table, None if the database is not reachable
+    try:
+        with db.proxy.connection_context():
+            tables = sorted([x for x in db.proxy.get_tables() if DAY_TABLE.match(x)], reverse=True)
+            if not tables:
+                return 0
+            db.ReportBase._meta.table_name = tables[0]
+            return db.ReportBase.select().where(db.ReportBase.claimable(c.MaxAttempts)).count()
+    except BaseException as e:
+        logging.error(f'Queue depth is unknown: {repr(e)}')
+        return None
+
+
+def node_load() -> float:
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (OSError, AttributeError):  # no load average on windows
+        return 0.0
+
+
+class Scheduler:
+    # main_mode at window_start, helpers helper_delay_minutes later. Inside the window helper_mode processes
+    # are added or drained every scale_interval seconds; between events the thread sleeps until the next one
+    def __init__(self, c, supervisor, depth=queue_depth, load=node_load):
+        self.c = c
+        self.supervisor = supervisor
+        self.depth = depth
+        self.load = load
+        self.stopped = Event()
+        self.drained = set()  # helpers signalled with USR1, RUNNING until their encodes are finished
+        self.start_time = c.WindowStart or '22:00'
+        now = datetime.now()
+        grace = timedelta(minutes=5)
+        self.main_fire = next_fire(self.start_time, now, grace)
+        self.helper_fire = next_fire(self.helper_time(), now, grace)
+        self.scale_fire = now
+
+    def helper_time(self) -> str:
+        return (at(datetime.now(), self.start_time) + timedelta(minutes=self.c.HelperDelay)).strftime('%H:%M')
+
+    def in_window(self) -> bool:
+        left = window_left(self.c)
+        return left is None or left > 0
+
+    def start_main(self):
+        name = self.c.MainProgram
+        if self.supervisor.start(f'{name}:{name}'):
+            logging.info(f'{name} started successful')
+
+    def start_helpers(self):
+        self.scale(helpers_wanted(self.depth(self.c), 0, self.load(), self.c))
+
+    def scale(self, wanted=None):
+        group = self.c.HelperProgram
+        running = self.supervisor.running(group)
+        self.drained &= set(running)
+        running = [x for x in running if x not in self.drained]
+        if wanted is None:
+            wanted = helpers_wanted(self.depth(self.c), len(running), self.load(), self.c)
+        if wanted > len(running):
+            for name in self.supervisor.stopped(group)[:wanted - len(running)]:
+                if self.supervisor.start(name):
+                    logging.info(f'{name} started successful')
+        elif wanted < len(running):
+            for name in running[wanted:]:
+                if self.supervisor.drain(name):
+                    self.drained.add(name)
+                    logging.info(f'{name} drained')
+
+    def tick(self, now):
+        if now >= self.main_fire:
+            self.start_main()
+            self.main_fire = next_fire(self.start_time, now + timedelta(minutes=1))
+        if now >= self.helper_fire:
+            self.start_helpers()
+            self.helper_fire = next_fire(self.helper_time(), now + timedelta(minutes=1))
+            self.scale_fire = now + timedelta(seconds=self.c.ScaleInterval)
+        if now >= self.scale_fire:
+            if self.in_window() and self.supervisor.running(self.c.HelperProgram):
+                self.scale()
+            self.scale_fire = now + timedelta(seconds=self.c.ScaleInterval)
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.tick(datetime.now())
+            except (OSError, xmlrpc.client.Error) as e:
+                logging.error(f'supervisord is not available: {repr(e)}')
+            wake = min(self.main_fire, self.helper_fire, self.scale_fire)
+            self.stopped.wait(max(1.0, (wake - datetime.now()).total_seconds()))
+
+    def stop(self, *args):
+        self.stopped.set()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    c = Conf()
+    db.proxy.initialize(c.arc_compress)
+    scheduler = Scheduler(c, Supervisor(connect(c.SupervisorUrl)))
+    signal.signal(signal.SIGTERM, scheduler.stop)
+    signal.signal(signal.SIGINT, scheduler.stop)
+    logging.info(f'Next main start {scheduler.main_fire}, helpers {scheduler.helper_fire}')
+    scheduler.run()
@@ -7,103 +7,152 @@ import time
 from datetime import datetime
 from pathlib import Path
 import shlex
+import socket
 from . import models as db
 import requests
 from .communication import Msg
+from .fileops import temp_name
+from .paths import resolver
+from .predictor import Predictor
+from .progress import FFmpeg
+from .probe import Probe
+from .resources import node
+from .segment import SegmentEncoder
+from .strategy import ENCODE, REMUX, Strategy
+
+VIDEO_TEMPLATE = '-c:v libx264 -pix_fmt yuv420p -preset {} -crf {} -profile:v high -x264opts "weightp=0:tff=1"'
+VIDEO_OPTIONS = VIDEO_TEMPLATE.format('medium', 22)
+profiles = dict()  # source class -> video options from calibration of this node
+AUDIO_OPTIONS = '-c:a aac -b:a 224k -ar 48000'
 
 
 class Transcode:
-    def __init__(self, c):
+    # probe and encode stages of the pipeline, one object per stage worker
+    def __init__(self, c, scratch=None):
         self.c = c
+        self.scratch = scratch
         self.m = Msg(c)
+        self.probe = Probe(c)
         db.proxy.initialize(c.arc_compress)
         self.problem = []
         self.i = 0
-        afp_soft_stop = Path(self.c.ScriptPath, 'soft_stop.json')
-        try:
-            self.c.stop_service = json.load(afp_soft_stop.open('r'))['stop_service']
-        except (FileNotFoundError, KeyError, json.decoder.JSONDecodeError):
-            self.c.stop_service = 0
-            json.dump({'stop_service': self.c.stop_service}, afp_soft_stop.open('w'))
-        db.proxy.connection()
-        for self.i in range(1, self.c.ItemLength + 1):
-            self.problem.clear()
-            if self.c.stop_service:
-                logging.info('Soft Stop! {} transcoded'.format(self.c.ItemLength))
-                break
-            self.query = db.ReportBase.get(db.ReportBase.id == self.i)
-            try:
-                if not self.query.in_work:
-                    self.query.in_work = True
-                    self.query.save()
-
-                    if self.query.transcode:
-                        self.c.Q.put(self.i)
-                    elif Path(self.query.userpath) != Path():
-                        if self.transcode():
-                            self.query.transcode = True
-                            self.query.save()
-                            self.c.Q.put(self.i)
-                        else:
-                            self.query.in_work = False
-                            self.query.save()
-                            if not db.ErrorsBase.select().where(db.ErrorsBase.clip_id == self.query.clip_id):
-                                db.ErrorsBase.create(item=self.query.item, clip_id=self.query.clip_id,
-                                                     userpath=self.query.userpath,
-                                                     problem=', '.join(self.problem))
-                    else:
-                        self.query.in_work = False
-                        self.query.save()
-            except BaseException as e:
-                logging.error('TRANSCODE THREAD PASSED WITH ERROR: {}'.format(repr(e)))
-                self.problem.append('TRANSCODE THREAD PASSED WITH ERROR: {}'.format(repr(e)))
-                self.query.in_work = False
-                self.query.save()
-                if not db.ErrorsBase.select().where(db.ErrorsBase.clip_id == self.query.clip_id):
-                    db.ErrorsBase.create(item=self.query.item, clip_id=self.query.clip_id,
-                                         userpath=self.query.userpath,
-                                         problem=', '.join(self.problem))
-
-        false_count = db.ReportBase.select().where(~db.ReportBase.transcode).count()
-        if false_count:
-            logging.warning('Not all transcoded !!!! From {} fail {}'.format(self.c.ItemLength, false_count))
+        self.query = None
+
+    def load(self, i):
+        self.i = i
+        self.problem.clear()
+        self.query = db.ReportBase.get(db.ReportBase.id == i)
+
+    def add_error(self):
+        if not db.ErrorsBase.select().where(db.ErrorsBase.clip_id == self.query.clip_id):
+            db.ErrorsBase.create(item=self.query.item, clip_id=self.query.clip_id,
+                                 userpath=self.query.userpath,
+                                 problem=', '.join(self.problem))
+
+    def files(self):
+        userpath = Path(self.query.userpath)
+        paths = resolver.get(userpath.parent)
+        if paths:
+            input_file = Path(paths.physics_path, userpath.name)
+            dst_file = Path(paths.new_path, userpath.stem + '.mov')
         else:
-            logging.info('All {} transcoded'.format(self.c.ItemLength))
-        db.proxy.close()
+            input_file = userpath
+            dst_file = Path(userpath.parent, userpath.stem + '.mov')
+        if self.c.DirectOutput:
+            # hidden file next to destination, copy stage only renames it
+            return input_file, temp_name(dst_file)
+        return input_file, Path(self.c.TempFolder, dst_file)
 
-    def is_multi_audio(self, file):
-        chk_string = '{} -v quiet -print_format json -show_streams {}'.format(self.c.ffp_path, shlex.quote(str(file)))
-        _args = shlex.split(chk_string)
+    def probe_source(self, i) -> bool:
+        self.load(i)
+        if Path(self.query.userpath) == Path():
+            return False
+        input_file, out_file = self.files()
+        if self.is_multi_audio(self.c.MediaLocation.joinpath(input_file)) == -1:
+            self.problem.append('Can`t probe source')
+            self.add_error()
+            return False
+        return True
+
+    def segmented(self, strategy) -> bool:
+        # long full encodes are split into segments, every segment worker reads the source from the mount
+        return strategy == ENCODE and bool(self.c.SegmentMinDuration) and \
+            self.query.duration >= self.c.SegmentMinDuration
+
+    def prefetch(self, i) -> bool:
+        self.load(i)
+        input_file, out_file = self.files()
+        input_file = self.c.MediaLocation.joinpath(input_file)
+        if self.segmented(Strategy(self.c, self.probe).decide(input_file)):
+            logging.info('{}/{} Staging skipped: segmented encode'.format(i, self.c.ItemLength))
+            return True
         try:
-            p = subprocess.run(_args, capture_output=True)
-            streams = json.loads(p.stdout)
-            a_streams = len(list(filter(lambda x: x['codec_type'] == 'audio', streams['streams'])))
+            self.scratch.stage(i, input_file)
+        except OSError as e:
+            # encode reads from the mount then
+            logging.warning('{}/{} Staging skipped: {}'.format(i, self.c.ItemLength, repr(e)))
+        return True
+
+    def encode(self, i) -> bool:
+        self.load(i)
+        started = time.monotonic()
+        try:
+            if self.transcode():
+                self.query.transcode = True
+                self.query.encode_time = time.monotonic() - started
+                self.query.save()
+                return True
         except BaseException as e:
-            logging.error('Can`t check audio channels: {}'.format(repr(e)))
+            logging.error('TRANSCODE THREAD PASSED WITH ERROR: {}'.format(repr(e)))
+            self.problem.append('TRANSCODE THREAD PASSED WITH ERROR: {}'.format(repr(e)))
+        finally:
+            if self.scratch is not None:
+                self.scratch.evict(i)
+        if self.c.stop_service:
+            # interrupted by soft stop, not a failure of the clip: the attempt is given back
+            db.ReportBase.update(attempts=db.ReportBase.attempts - 1).where(db.ReportBase.id == i).execute()
+            return False
+        self.add_error()
+        return False
+
+    def progress(self, position, speed):
+        # live state for the report and for capacity of the window
+        self.query.progress = position
+        self.query.speed = speed
+        self.query.save()
+        logging.debug('{}/{} {:.0f}/{:.0f}s at {}x'.format(self.i, self.c.ItemLength, position, self.query.duration,
+                                                          speed))
+
+    def video_options(self) -> str:
+        key = Predictor.source_class(self.query.item)
+        if key not in profiles:
+            row = db.ProfileBase.get_or_none((db.ProfileBase.host == socket.gethostname()) &
+                                             (db.ProfileBase.source_class == key))
+            profiles[key] = VIDEO_TEMPLATE.format(row.preset, row.crf) if row else \
+                VIDEO_TEMPLATE.format('medium', self.c.Crf)
+            logging.info('Video options for {}: {}'.format(key, profiles[key]))
+        return profiles[key]
+
+    def is_multi_audio(self, file):
+        if not self.probe.get(file):
+            logging.error('Can`t check audio channels for {}'.format(file))
             return -1
-        else:
-            logging.info('{}/{} Number of audio streams = {}'.format(self.i, self.c.ItemLength, a_streams))
-            return int(a_streams)
+        a_streams = len(self.probe.streams(file, 'audio'))
+        logging.info('{}/{} Number of audio streams = {}'.format(self.i, self.c.ItemLength, a_streams))
+        return a_streams
 
-    def is_same_length(self, orig_file, done_file, es_duration) -> bool:
+    def is_same_length(self, orig_file, done_file, es_duration, orig_source=True) -> bool:
         files = [orig_file, done_file]
         length = [es_duration, 0]
         for j in range(2):
             file = files[j]
             if file.exists():
-                chk_string = '{} -v quiet -print_format json -show_streams {}'.format(self.c.ffp_path,
-                                                                                      shlex.quote(str(file)))
-                _args = shlex.split(chk_string)
-                try:
-                    p = subprocess.run(_args, capture_output=True)
-                    streams = json.loads(p.stdout)
-                    duration = list(filter(lambda x: x['codec_type'] == 'video',
-                                           streams.get('streams', list(dict(duration=0)))))[0]['duration']
-                except BaseException as e:
-                    witch = 'converted' if j else 'original'
-                    logging.warning(f'Can`t detect duration for {witch} {file}\n{repr(e)}')
+                duration = self.probe.duration(file, source=orig_source and not j)
+                if duration:
+                    length[j] = duration
                 else:
-                    length[j] = float(duration)
+                    witch = 'converted' if j else 'original'
+                    logging.warning(f'Can`t detect duration for {witch} {file}')
 
         if abs(length[0] - length[1]) <= length[0] / 20:
             logging.info('{}/{} Length check SUCCESS'.format(self.i, self.c.ItemLength))
@@ -134,17 +183,7 @@ class Transcode:
 
         logging.info(
             '{}/{} START transcoding\n{}'.format(self.i, self.c.ItemLength, self.c.MediaLocation.joinpath(userpath)))
-        pb_query = db.PathsBase.select().where(db.PathsBase.old_path == str(userpath.parent))
-        if pb_query.exists():
-            path_query = pb_query.get()
-            physics_path = Path(path_query.physics_path)
-            new_path = Path(path_query.new_path)
-
-            input_file = Path(physics_path, userpath.name)
-            out_file = Path(self.c.TempFolder, new_path, userpath.stem + '.mov')
-        else:
-            input_file = userpath
-            out_file = Path(self.c.TempFolder, userpath.parent, userpath.stem + '.mov')
+        input_file, out_file = self.files()
 
         os.makedirs(self.c.MediaLocation.joinpath(out_file.parent), exist_ok=True)
 
@@ -250,7 +289,8 @@ class Transcode:
                 self.problem.append('AME StreamCopy PROBLEM: {}'.format(pr.stderr))
             if self.is_same_length(self.c.MediaLocation.joinpath(ame_out_file),
                                    abs_out_file,
-                                   self.c.MediaLocation.joinpath(ame_out_file).stat().st_size):
+                                   self.c.MediaLocation.joinpath(ame_out_file).stat().st_size,
+                                   orig_source=False):
                 logging.info('{}/{} AME StreamCopy SUCCESSFUL for {}'.format(self.i, self.c.ItemLength, abs_out_file))
                 if self.c.MediaLocation.joinpath(ame_out_file).exists():
                     self.c.MediaLocation.joinpath(ame_out_file).unlink()
@@ -272,6 +312,8 @@ class Transcode:
         duration_seconds = self.query.duration
         input_file = self.c.MediaLocation.joinpath(input_file)
         out_file = self.c.MediaLocation.joinpath(out_file)
+        # local copy from scratch if staged, segments are read from the mount by other nodes too
+        source = self.scratch.get(self.i, input_file) if self.scratch is not None else input_file
         c_time = datetime.strftime(date_for_change, '%Y-%m-%d %H:%M:%S')
         logging.debug(f'!!!!!!!!!!!!!!!!! for file "{out_file}" ctime={c_time}')
 
@@ -286,44 +328,73 @@ class Transcode:
         audio_channels = self.is_multi_audio(input_file)
         if audio_channels == -1:
             return False
+
+        strategy = Strategy(self.c, self.probe).decide(input_file)
+        self.query.strategy = strategy
+        self.query.save()
+        logging.info('{}/{} Strategy: {}'.format(self.i, self.c.ItemLength, strategy))
+        video_options = self.video_options() + node.threads_option() if strategy == ENCODE else '-c:v copy'
+        mono_audio = '-c:a copy' if strategy == REMUX else AUDIO_OPTIONS + ' -ac 1'
+        stereo_audio = '-c:a copy' if strategy == REMUX else AUDIO_OPTIONS + ' -ac 2'
+
+        if self.segmented(strategy):
+            if audio_channels == 0:
+                audio_options = ''
+            elif audio_channels == 4:
+                audio_options = '-map 0:a:0 -map 0:a:1 -map 0:a:2 -map 0:a:3 ' + mono_audio
+            else:
+                audio_options = stereo_audio
+            se = SegmentEncoder(self.c, self.i)
+            done = se.encode(input_file, out_file, self.video_options(), audio_options, tc, c_time,
+                             duration_seconds, self.query.id)
+            self.problem.extend(se.problem)
+            if not done:
+                # failed segment or soft stop, there is no result to check
+                return False
+            return self.check_result(input_file, out_file, duration_seconds, date_for_change)
         elif audio_channels == 0:
             encoder_string = '{} -hide_banner -loglevel error -vsync 0 -i {} -c copy ' \
-                             '-c:v libx264 -pix_fmt yuv420p -preset medium -crf 22 -profile:v high ' \
-                             '-x264opts "weightp=0:tff=1" ' \
+                             '{} ' \
                              '-write_tmcd 1 -gop_timecode {} -metadata creation_time={} -metadata timecode={} ' \
                              '-an ' \
                              '-y -f mov {}'.format(self.c.ffm_path,
-                                                   shlex.quote(str(input_file)),
+                                                   shlex.quote(str(source)),
+                                                   video_options,
                                                    shlex.quote(tc), shlex.quote(c_time), shlex.quote(tc),
                                                    shlex.quote(str(out_file)))
         elif audio_channels == 4:
             # c_filter = '[0:v]setpts=PTS-STARTPTS[v];[0:a:0][0:a:1]join=inputs=2:channel_layout=stereo[a]'
             c_filter = '[0:v]setpts=PTS-STARTPTS[v]'
+            # filters need decoding, copied video is mapped as is
+            video_map = '-filter_complex {} -map [v]'.format(shlex.quote(c_filter)) if strategy == ENCODE \
+                else '-map 0:v:0'
             encoder_string = '{} -hide_banner -loglevel error -vsync 0 -i {} -c copy ' \
-                             '-filter_complex {} ' \
-                             '-map [v] -map 0:a:0 -map 0:a:1 -map 0:a:2 -map 0:a:3 ' \
-                             ' -c:v libx264 -pix_fmt yuv420p -preset medium -crf 22 -profile:v high ' \
-                             '-x264opts "weightp=0:tff=1" ' \
+                             '{} ' \
+                             '-map 0:a:0 -map 0:a:1 -map 0:a:2 -map 0:a:3 ' \
+                             ' {} ' \
                              '-write_tmcd 1 -gop_timecode {} -metadata creation_time={} -metadata timecode={} ' \
-                             '-c:a aac -b:a 224k -ac 1 -ar 48000 ' \
+                             '{} ' \
                              '-y -f mov {}'.format(self.c.ffm_path,
-                                                   shlex.quote(str(input_file)),
-                                                   shlex.quote(c_filter),
+                                                   shlex.quote(str(source)),
+                                                   video_map,
+                                                   video_options,
                                                    shlex.quote(tc),
                                                    shlex.quote(c_time),
                                                    shlex.quote(tc),
+                                                   mono_audio,
                                                    shlex.quote(str(out_file)))
         else:
             encoder_string = '{} -hide_banner -loglevel error -vsync 0 -i {} -c copy ' \
-                             '-c:v libx264 -pix_fmt yuv420p -preset medium -crf 22 -profile:v high ' \
-                             '-x264opts "weightp=0:tff=1" ' \
+                             '{} ' \
                              '-write_tmcd 1 -gop_timecode {} -metadata creation_time={} -metadata timecode={} ' \
-                             '-c:a aac -b:a 224k -ac 2 -ar 48000 ' \
+                             '{} ' \
                              '-y -f mov {}'.format(self.c.ffm_path,
-                                                   shlex.quote(str(input_file)),
+                                                   shlex.quote(str(source)),
+                                                   video_options,
                                                    shlex.quote(tc),
                                                    shlex.quote(c_time),
                                                    shlex.quote(tc),
+                                                   stereo_audio,
                                                    shlex.quote(str(out_file)))
 
         # ------ write to file ---------
@@ -336,16 +407,28 @@ class Transcode:
             self.c.ScriptPath.joinpath('transcode.sh').chmod(0o755)
         # ------------------------------
 
-        args = shlex.split(encoder_string)
-        pr = subprocess.run(args, capture_output=True, universal_newlines=True, timeout=duration_seconds * 2)
-        if pr.stderr:
+        with node.slot() as n:
+            ff = FFmpeg(self.c, shlex.split(node.command(encoder_string, n)), duration_seconds, self.progress)
+            ff.run()
+        self.progress(ff.position, ff.speed)
+        if ff.aborted:
+            # killed after soft stop, the item is released and encoded again by the next run
+            out_file.unlink(missing_ok=True)
+            return False
+        if ff.stalled:
+            self.problem.append('STALLED at {:.0f}s'.format(ff.position))
+            return False
+        if ff.stderr:
             ignore_list = ['Application provided duration: -']
-            pr_error = str(pr.stderr)
+            pr_error = str(ff.stderr)
             pr_error = pr_error.encode(encoding='cp1251', errors='ignore').decode(encoding='cp1251',
                                                                                   errors='ignore')
             if ignore_list[0] not in pr_error:
                 logging.error('{}/{} PROBLEM Transcoding: '.format(self.i, self.c.ItemLength, pr_error))
                 self.problem.append('PROBLEM Transcoding: {}'.format(pr_error))
+        return self.check_result(input_file, out_file, duration_seconds, date_for_change)
+
+    def check_result(self, input_file, out_file, duration_seconds, date_for_change) -> bool:
         if self.is_same_length(input_file, out_file, duration_seconds):
             change_file_creation_time(out_file, date_for_change)
             logging.info('{}/{} Transcoding SUCCESSFUL'.format(self.i, self.c.ItemLength))
@@ -353,6 +436,7 @@ class Transcode:
         else:
             logging.error('{}/{} Transcode FAILED\n{}'.format(self.i, self.c.ItemLength, input_file))
             self.problem.append('Length of original and transcoded files is DIFFERENT')
+            return False
 
 
 def change_file_creation_time(path, created):
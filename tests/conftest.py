@@ -0,0 +1,60 @@
+import re
+
+import pytest
+from peewee import MySQLDatabase
+
+from app import models as db
+
+
+class FakeCursor:
+    def __init__(self, rowcount, columns=(), rows=()):
+        self.rowcount = rowcount
+        self.description = [(x,) for x in columns]
+        self.rows = list(rows)
+        self.lastrowid = 0
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, list()
+        return rows
+
+    def close(self):
+        pass
+
+
+class RecordingDatabase(MySQLDatabase):
+    # MySQL dialect without a server: every statement is recorded without table qualifiers of columns,
+    # UPDATE reports `rowcount` changed rows, SELECT returns the next (columns, rows) of `results` if any
+    def __init__(self):
+        super().__init__('test', autoconnect=False)
+        self.statements = list()
+        self.rowcount = 1
+        self.results = list()
+
+    def execute_sql(self, sql, params=None, commit=None):
+        self.statements.append((re.sub(r'`[^`]+`\.', '', sql), list(params or ())))
+        if sql.startswith('SELECT') and self.results:
+            return FakeCursor(self.rowcount, *self.results.pop(0))
+        return FakeCursor(self.rowcount)
+
+    def begin(self, *args, **kwargs):
+        self.statements.append(('BEGIN', list()))
+
+    def commit(self):
+        self.statements.append(('COMMIT', list()))
+
+    def rollback(self):
+        self.statements.append(('ROLLBACK', list()))
+
+
+@pytest.fixture
+def sql():
+    database = RecordingDatabase()
+    db.proxy.initialize(database)
+    table_name = db.ReportBase._meta.table_name
+    db.ReportBase._meta.table_name = '2026-10-18'
+    yield database
+    db.ReportBase._meta.table_name = table_name
+    db.proxy.initialize(None)
@@ -0,0 +1,27 @@
+from types import SimpleNamespace
+
+from app.capacity import Capacity
+from app.resources import node
+
+
+def capacity(monkeypatch, rate):
+    c = Capacity(SimpleNamespace(BatchHours=8, WindowStart='', WindowEnd=''))
+    c.rate, c.nodes = rate, 2
+    monkeypatch.setattr(c, 'seconds_left', lambda: 3600.0)
+    monkeypatch.setattr(node, 'slots', 2)
+    return c
+
+
+def test_unknown_throughput(monkeypatch, sql):
+    assert capacity(monkeypatch, None).room() is None
+    assert sql.statements == []
+
+
+def test_running_encodes_count_by_measured_speed(monkeypatch, sql):
+    # 7200 media seconds per hour per node, 2 nodes, one hour left. 1000 s of media wait, running encodes
+    # need 600 s more, a slot (7200 / 2 per hour) would encode 600 s of media meanwhile
+    sql.results = [(('sum',), [(1000.0,)]), (('sum',), [(600.0,)])]
+    assert capacity(monkeypatch, 7200).room() == 7200 * 2 - (1000 + 600)
+    waiting, running = sql.statements
+    assert 'NOT (((`in_work` AND (`lease_until` >= NOW())) AND NOT `transcode`) AND (`speed` > %s))' in waiting[0]
+    assert running[0].startswith('SELECT SUM(GREATEST((`duration` - `progress`), %s) / `speed`) FROM')
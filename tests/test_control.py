@@ -0,0 +1,38 @@
+import json
+import os
+import signal
+from types import SimpleNamespace
+
+from app.control import Control
+
+
+def control(tmp_path):
+    return Control(SimpleNamespace(ScriptPath=tmp_path, arc_compress=None, stop_service=0, stop_time=0.0))
+
+
+def test_missing_file_is_created_without_stop(tmp_path):
+    ctl = control(tmp_path)
+    ctl.read_file()
+    assert json.loads((tmp_path / 'soft_stop.json').read_text()) == {'stop_service': 0}
+    assert not ctl.c.stop_service
+
+
+def test_file_is_read_again_only_when_changed(tmp_path):
+    ctl = control(tmp_path)
+    path = tmp_path / 'soft_stop.json'
+    path.write_text(json.dumps({'stop_service': 0}))
+    ctl.read_file()
+    assert not ctl.c.stop_service
+    path.write_text(json.dumps({'stop_service': 1}))
+    os.utime(path, (1, 1))
+    ctl.read_file()
+    assert ctl.c.stop_service and ctl.c.stop_time > 0
+
+
+def test_first_signal_is_a_soft_stop(tmp_path):
+    ctl = control(tmp_path)
+    ctl.on_signal(signal.SIGTERM, None)
+    assert ctl.c.stop_service
+    # USR1 again only repeats the request
+    ctl.on_signal(signal.SIGUSR1, None)
+    assert ctl.c.stop_service
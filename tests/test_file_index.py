@@ -0,0 +1,44 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+from app.file_index import FileIndex
+
+
+def make_index(tmp_path):
+    root = tmp_path / 'media'
+    root.mkdir()
+    c = SimpleNamespace(MediaLocation=root, ScriptPath=tmp_path, FileIndex='index.sqlite', TempFolder='TEMP')
+    return root, FileIndex(c)
+
+
+def put(root, rel, size):
+    path = root.joinpath(rel)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'0' * size)
+
+
+def test_same_name_other_size_elsewhere_is_rejected(tmp_path):
+    root, index = make_index(tmp_path)
+    put(root, 'news/2021/C0001.MXF', 100)
+    put(root, 'sport/2021/C0001.MXF', 200)
+    # nothing of the original path exists: only a file of the same size is accepted
+    assert index.find('weather/2021/C0001.MXF', 300) is None
+    assert index.find('weather/2021/C0001.MXF', 100) == Path('news/2021')
+    # nearest existing ancestor is news, the sport file is not under it
+    assert index.find('news/2022/C0001.MXF', 200) == Path('sport/2021')
+    assert index.find('news/2022/C0001.MXF', 300) == Path('news/2021')
+
+
+def test_candidate_under_nearest_ancestor(tmp_path):
+    root, index = make_index(tmp_path)
+    put(root, 'news/2021/moved/C0001.MXF', 100)
+    put(root, 'sport/2021/C0001.MXF', 200)
+    assert index.find('news/2021/lost/C0001.MXF', 999) == Path('news/2021/moved')
+
+
+def test_size_match_wins(tmp_path):
+    root, index = make_index(tmp_path)
+    put(root, 'news/a/C0001.MXF', 100)
+    put(root, 'news/b/C0001.MXF', 200)
+    assert index.find('news/x/C0001.MXF', 200) == Path('news/b')
+    assert index.find('news/x/C0002.MXF', 200) is None
@@ -0,0 +1,14 @@
+from pathlib import Path
+
+from app.fileops import temp_name
+
+
+def test_temp_name_is_hidden_next_to_the_result():
+    assert temp_name('/arc/news/clip.mov') == Path('/arc/news/.clip.mov.part')
+
+
+def test_temp_name_tag_separates_writers():
+    a = temp_name('/arc/news/.clip.segments/seg_0001.mov', 'a1b2')
+    b = temp_name('/arc/news/.clip.segments/seg_0001.mov', 'c3d4')
+    assert a == Path('/arc/news/.clip.segments/.seg_0001.mov.a1b2.part')
+    assert a != b
@@ -0,0 +1,73 @@
+from app import models as db
+
+
+def test_claim_reserves_rows_in_one_update(sql):
+    sql.rowcount = 0
+    assert db.ReportBase.claim('node:1', limit=5, max_attempts=3, lease=300) == []
+    assert len(sql.statements) == 1
+    statement, params = sql.statements[0]
+    assert statement.startswith('UPDATE `2026-10-18` SET `in_work` = %s, `owner` = %s, `claim_id` = %s')
+    assert '`attempts` = (`attempts` + %s)' in statement
+    # free or expired rows, not finished, attempts left
+    assert '(NOT `in_work` OR ((`lease_until` IS NULL) OR (`lease_until` < NOW())))' in statement
+    assert '(`attempts` < %s)' in statement
+    assert statement.endswith('ORDER BY `deferred`, `id` LIMIT %s')
+    assert params[:2] == [True, 'node:1'] and params[-2:] == [3, 5]
+
+
+def test_claimed_rows_are_selected_by_claim_id(sql):
+    rows = db.ReportBase.claim('node:1', limit=2, where=db.ReportBase.duration < 600)
+    assert rows == []
+    update, select = sql.statements
+    assert '(`duration` < %s)' in update[0]
+    assert select[0].endswith('FROM `2026-10-18` AS `t1` WHERE (`claim_id` = %s) ORDER BY `deferred`, `id`')
+    assert select[1] == [update[1][2]]
+
+
+
+def test_renew_extends_only_own_rows(sql):
+    db.ReportBase.renew('node:1', 120)
+    db.SegmentBase.renew('node:1', 120)
+    (report, report_params), (segment, segment_params) = sql.statements
+    assert report == 'UPDATE `2026-10-18` SET `lease_until` = NOW() + INTERVAL %s SECOND ' \
+                     'WHERE (`in_work` AND (`owner` = %s))'
+    assert segment == 'UPDATE `!_segments_!` SET `lease_until` = NOW() + INTERVAL %s SECOND ' \
+                      'WHERE ((`status` = %s) AND (`owner` = %s))'
+    assert report_params == [120, 'node:1'] and segment_params == [120, 'work', 'node:1']
+
+
+def test_lease_alive_needs_a_lease_in_the_future(sql):
+    db.ReportBase.select().where(db.ReportBase.lease_alive()).count()
+    assert '(`in_work` AND (`lease_until` >= NOW()))' in sql.statements[0][0]
+
+
+CATALOG = ('id', 'day_table', 'complete', 'total', 'started', 'finished', 'alive')
+
+
+def test_catalog_without_marker_is_complete(sql):
+    assert db.CatalogBase.is_complete('2026-10-18')
+    assert len(sql.statements) == 1
+
+
+def test_catalog_in_progress_waits_for_its_builder(sql):
+    sql.results = [(CATALOG, [(1, '2026-10-18', 0, 0, None, None, None)]), ((), [])]
+    assert not db.CatalogBase.is_complete('2026-10-18', lease=300)
+    statement, params = sql.statements[1]
+    assert '(COALESCE(`alive`, `started`) < NOW() - INTERVAL %s SECOND)' in statement
+    assert 300 in params
+
+
+def test_catalog_of_dead_builder_is_abandoned(sql):
+    sql.results = [(CATALOG, [(1, '2026-10-18', 0, 0, None, None, None)]), (('1',), [(1,)])]
+    assert db.CatalogBase.is_complete('2026-10-18', lease=300)
+
+
+def test_catalog_renew_touches_unfinished_marker(sql):
+    db.CatalogBase.renew('2026-10-18')
+    assert sql.statements[0][0] == 'UPDATE `!_catalog_!` SET `alive` = NOW() ' \
+                                   'WHERE ((`day_table` = %s) AND NOT `complete`)'
+
+
+def test_undone_leaves_out_skipped_rows(sql):
+    db.ReportBase.select().where(db.ReportBase.undone()).count()
+    assert 'WHERE (NOT `skipped` AND ((((NOT `transcode` OR NOT `clip_delete`)' in sql.statements[0][0]
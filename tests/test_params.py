@@ -0,0 +1,8 @@
+from app.params import TlsAdapter
+
+
+def test_pool_is_sized_by_pool_maxsize():
+    adapter = TlsAdapter(pool_maxsize=8)
+    pool = adapter.poolmanager.connection_from_url('https://api.example.com')
+    assert pool.pool.maxsize == 8
+    assert adapter.poolmanager.connection_pool_kw['ssl_version'] is not None
@@ -0,0 +1,35 @@
+from types import SimpleNamespace
+
+from app.predictor import Predictor
+
+
+def item(codec='mpeg2video', width=1920, height=1080):
+    return dict(data=dict(video=[dict(video_codec=codec, width=width, height=height)]))
+
+
+def predictor():
+    return Predictor(SimpleNamespace(PredictBitrate=12000, PredictSpeed=1.0, MinSavings=15))
+
+
+def test_without_history_bitrate_is_scaled_by_frame_size():
+    p = predictor()
+    # 12000 kbps for 100 s of 1080p is 150 MB
+    assert p.predict(item(), 500_000_000, 100) == (150_000_000, 100.0)
+    assert p.predict(item(width=960, height=540), 500_000_000, 100)[0] == 37_500_000
+    # never more than the source
+    assert p.predict(item(), 100_000_000, 100)[0] == 100_000_000
+
+
+def test_class_history_wins_over_the_default():
+    p = predictor()
+    p.ratio, p.speed = {'mpeg2video|1080': 0.2}, {'mpeg2video|1080': 4.0}
+    p.default_ratio, p.default_speed = 0.5, 2.0
+    assert p.predict(item(), 1000, 100) == (200, 25.0)
+    assert p.predict(item('h264'), 1000, 100) == (500, 50.0)
+
+
+def test_low_savings():
+    p = predictor()
+    assert p.low_savings(1000, 900)
+    assert not p.low_savings(1000, 850)
+    assert not p.low_savings(0, 0)
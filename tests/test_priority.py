@@ -0,0 +1,95 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from app import models as db
+from app import priority
+from app.priority import Scheduler, Window, window_left
+
+
+def at_time(monkeypatch, hhmm):
+    now = datetime(2026, 10, 18, *[int(x) for x in hhmm.split(':')])
+
+    class Clock(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return now
+
+    monkeypatch.setattr(priority, 'datetime', Clock)
+
+
+def conf(**kwargs):
+    c = SimpleNamespace(WindowStart='', WindowEnd='', Owner='node:1', IngestOverhead=30, IngestRate=100,
+                        SegmentDuration=300, SchedulePolicy='id', SjfBeforeEnd=60)
+    c.__dict__.update(kwargs)
+    return c
+
+
+def test_no_window():
+    assert window_left(conf()) is None
+
+
+@pytest.mark.parametrize('now, left', [('22:00', 8 * 3600), ('23:30', 6.5 * 3600), ('05:59', 60),
+                                       ('06:00', 0), ('12:00', 0), ('21:59', 0)])
+def test_window_across_midnight(monkeypatch, now, left):
+    at_time(monkeypatch, now)
+    assert window_left(conf(WindowStart='22:00', WindowEnd='06:00')) == left
+
+
+@pytest.mark.parametrize('now, left', [('01:00', 3600), ('03:00', 0), ('00:59', 3660)])
+def test_window_inside_one_day(monkeypatch, now, left):
+    at_time(monkeypatch, now)
+    assert window_left(conf(WindowStart='00:30', WindowEnd='02:00')) == left
+
+
+def test_window_end_only_counts_to_the_next_end(monkeypatch):
+    at_time(monkeypatch, '07:00')
+    assert window_left(conf(WindowEnd='06:00')) == 23 * 3600
+
+
+def test_fits_uses_item_speed_then_host_speed(sql, monkeypatch):
+    window = Window(conf())
+    monkeypatch.setattr(window, 'node_speed', lambda: 2.0)
+    db.ReportBase.select().where(window.fits(3600)).count()
+    statement, params = sql.statements[0]
+    assert 'IF((`speed` > %s), (GREATEST((`duration` - `progress`), %s) / `speed`), (`duration` / %s))' \
+           in statement
+    assert 2.0 in params and 3600 in params
+    # transcoded items need only ingest
+    assert 'OR (`transcode` AND' in statement
+
+
+def test_fits_without_window(sql):
+    assert Window(conf()).fits(None) is None
+
+
+def test_segment_fits(monkeypatch):
+    window = Window(conf())
+    monkeypatch.setattr(window, 'node_speed', lambda: 0.5)
+    assert window.segment_fits(600) and not window.segment_fits(599)
+    assert window.segment_fits(None)
+
+
+
+def test_close_to_the_end_switches_to_shortest_first(sql, monkeypatch):
+    scheduler = Scheduler(conf(WindowStart='22:00', WindowEnd='06:00', SchedulePolicy='oldest'))
+    at_time(monkeypatch, '23:00')
+    assert scheduler.order()[1] is db.ReportBase.captured
+    at_time(monkeypatch, '05:30')
+    order = scheduler.order()
+    assert order[0] is db.ReportBase.deferred and order[-1] is db.ReportBase.id
+    assert scheduler.current is priority.by_shortest
+
+
+def test_unknown_policy_falls_back_to_id(sql):
+    scheduler = Scheduler(conf(SchedulePolicy='random'))
+    assert scheduler.order() == [db.ReportBase.deferred, db.ReportBase.id]
+
+
+def test_savings_policy_orders_by_bytes_per_encode_second(sql):
+    scheduler = Scheduler(conf(SchedulePolicy='savings'))
+    list(db.ReportBase.select().order_by(*scheduler.order()))
+    statement = sql.statements[0][0]
+    assert 'ORDER BY `deferred`, ((`orig_size` - `predicted_size`) / ' \
+           'GREATEST(IF((`predicted_time` > %s), `predicted_time`, `duration`), %s)) DESC, `id`' in statement
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+
+from app.probe import Probe
+
+NO_VIDEO_DURATION = {'streams': [{'codec_type': 'video'}, {'codec_type': 'audio', 'duration': '60.0'}],
+                     'format': {'duration': '60.0'}}
+
+
+def make_probe(tmp_path, data):
+    media = tmp_path / 'media'
+    media.mkdir()
+    probe = Probe(SimpleNamespace(MediaLocation=media, ffp_path='ffprobe'))
+    calls = list()
+    probe.run = lambda file: calls.append(file) or data
+    return media, probe, calls
+
+
+def test_output_without_video_duration_has_no_length(tmp_path):
+    media, probe, calls = make_probe(tmp_path, NO_VIDEO_DURATION)
+    output = media / '.clip.mov.part'
+    output.write_bytes(b'0')
+    # source=False never touches ProbeBase, there is no database here
+    assert probe.duration(output, source=False) == 0.0
+    assert probe.duration(output, source=False) == 0.0
+    assert len(calls) == 1
+
+
+def test_source_falls_back_to_container_duration(tmp_path):
+    media, probe, calls = make_probe(tmp_path, NO_VIDEO_DURATION)
+    # scratch copy outside of the mount is probed without ProbeBase too
+    source = tmp_path / 'clip.mxf'
+    source.write_bytes(b'0')
+    assert probe.duration(source) == 60.0
+
+
+def test_video_stream_duration_wins(tmp_path):
+    media, probe, calls = make_probe(tmp_path, {'streams': [{'codec_type': 'video', 'duration': '59.5'}],
+                                                'format': {'duration': '60.0'}})
+    output = media / 'clip.mov'
+    output.write_bytes(b'0')
+    assert probe.duration(output, source=False) == 59.5
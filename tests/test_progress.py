@@ -0,0 +1,51 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.progress import FFmpeg
+
+FAKE_FFMPEG = '''#!/bin/sh
+for i in 1 2; do echo "out_time_us=${i}000000"; echo "speed=2.5x"; echo "progress=continue"; sleep 0.2; done
+case "$*" in *hang*) exec sleep 30 ;; esac
+echo "progress=end"
+'''
+
+
+@pytest.fixture
+def ffmpeg(tmp_path):
+    script = tmp_path / 'ffmpeg'
+    script.write_text(FAKE_FFMPEG)
+    script.chmod(0o755)
+    return str(script)
+
+
+def conf(**kwargs):
+    c = SimpleNamespace(StallSeconds=30, MaxTimeFactor=4, ProgressInterval=0, StopGrace=0, stop_service=0,
+                        stop_time=0.0)
+    c.__dict__.update(kwargs)
+    return c
+
+
+def test_progress_is_reported_from_the_calling_thread(ffmpeg):
+    calls = list()
+    ff = FFmpeg(conf(), [ffmpeg, 'ok'], 10, lambda *args: calls.append((threading.current_thread(), args)))
+    assert ff.run()
+    assert ff.position == 2.0 and ff.speed == 2.5
+    assert calls and all(thread is threading.current_thread() for thread, args in calls)
+
+
+def test_stalled_encode_is_killed(ffmpeg):
+    ff = FFmpeg(conf(StallSeconds=1), [ffmpeg, 'hang'], 10)
+    started = time.monotonic()
+    assert not ff.run()
+    assert ff.stalled and not ff.aborted
+    assert time.monotonic() - started < 10
+
+
+def test_encode_is_aborted_after_stop_grace(ffmpeg):
+    c = conf(StopGrace=1, stop_service=1, stop_time=time.monotonic())
+    ff = FFmpeg(c, [ffmpeg, 'hang'], 10)
+    assert not ff.run()
+    assert ff.aborted and not ff.stalled
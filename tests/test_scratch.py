@@ -0,0 +1,46 @@
+import threading
+from types import SimpleNamespace
+
+from app.scratch import Scratch
+
+
+def scratch(tmp_path, budget_bytes):
+    c = SimpleNamespace(ScratchDir=str(tmp_path / 'scratch'), ScratchBudget=budget_bytes / 1024 ** 3, ItemLength=1)
+    return Scratch(c)
+
+
+def source(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(b'0' * size)
+    return path
+
+
+def test_stage_get_and_evict(tmp_path):
+    s = scratch(tmp_path, 1000)
+    clip = source(tmp_path, 'clip.mxf', 600)
+    assert s.stage(1, clip)
+    local = s.get(1, clip)
+    assert local != clip and local.read_bytes() == clip.read_bytes()
+    assert s.get(2, clip) == clip
+    s.evict(1)
+    assert not local.exists() and s.used == 0
+    s.evict(1)
+
+
+def test_source_over_budget_is_not_staged(tmp_path):
+    s = scratch(tmp_path, 100)
+    assert not s.stage(1, source(tmp_path, 'clip.mxf', 101))
+    assert s.used == 0
+
+
+def test_staging_waits_for_budget(tmp_path):
+    s = scratch(tmp_path, 1000)
+    assert s.stage(1, source(tmp_path, 'a.mxf', 600))
+    staged = threading.Event()
+    thread = threading.Thread(target=lambda: s.stage(2, source(tmp_path, 'b.mxf', 600)) and staged.set())
+    thread.start()
+    assert not staged.wait(0.3)
+    s.evict(1)
+    assert staged.wait(5)
+    thread.join()
+    assert s.used == 600
@@ -0,0 +1,78 @@
+import shlex
+from pathlib import Path
+from types import SimpleNamespace
+
+from app.segment import SegmentEncoder
+
+
+def encoder(tmp_path, **kwargs):
+    c = SimpleNamespace(SegmentDuration=300, MediaLocation=tmp_path, ffm_path='ffmpeg', ffp_path='ffprobe',
+                        ItemLength=1, MaxAttempts=3)
+    c.__dict__.update(kwargs)
+    return SegmentEncoder(c)
+
+
+def test_split_points_follow_keyframes(tmp_path, monkeypatch):
+    se = encoder(tmp_path)
+    monkeypatch.setattr(se, 'keyframe_after', lambda file, t: t + 1.5)
+    assert se.split_points('clip.mxf', 1200) == [0.0, 301.5, 601.5, 901.5]
+    # a tail shorter than half a segment stays with the last one
+    assert se.split_points('clip.mxf', 1049) == [0.0, 301.5, 601.5]
+    assert se.split_points('clip.mxf', 1051) == [0.0, 301.5, 601.5, 901.5]
+    assert se.split_points('clip.mxf', 149) == [0.0]
+
+
+def test_split_points_skip_keyframes_that_do_not_move(tmp_path, monkeypatch):
+    se = encoder(tmp_path)
+    # long GOP: the next keyframe after 300 and 600 is the same
+    monkeypatch.setattr(se, 'keyframe_after', lambda file, t: 700.0 if t < 700 else t)
+    assert se.split_points('clip.mxf', 1200) == [0.0, 700.0, 900.0]
+
+
+def test_concat_of_segments_and_audio(tmp_path):
+    se = encoder(tmp_path)
+    rows = [dict(number=n, kind='video', output='news/.clip.segments/seg_{:04d}.mov'.format(n)) for n in (1, 0, 2)]
+    rows.append(dict(number=3, kind='audio', output='news/.clip.segments/audio.mov'))
+    out_file = Path(tmp_path, "news/clip's.mov")
+    args = shlex.split(se.concat(tmp_path, rows, '-c:a aac', '10:00:00:00', '2026-10-18 01:00:00', out_file))
+    assert Path(tmp_path, 'concat.txt').read_text() == \
+        "file 'seg_0000.mov'\nfile 'seg_0001.mov'\nfile 'seg_0002.mov'\n"
+    assert args[args.index('-f') + 1] == 'concat'
+    assert args[args.index('-i', args.index('-i') + 1) + 1] == str(Path(tmp_path, 'audio.mov'))
+    assert ['-map', '0:v', '-map', '1:a', '-c', 'copy'] == args[args.index('-map'):args.index('copy') + 1]
+    assert args[-1] == str(out_file)
+
+
+def test_concat_without_audio(tmp_path):
+    se = encoder(tmp_path)
+    rows = [dict(number=0, kind='video', output='seg_0000.mov')]
+    args = shlex.split(se.concat(tmp_path, rows, '', '10:00:00:00', '2026-10-18 01:00:00', Path('clip.mov')))
+    assert args.count('-i') == 1 and '1:a' not in args
+
+
+def test_register_resumes_from_finished_segments(tmp_path, monkeypatch, sql):
+    se = encoder(tmp_path)
+    monkeypatch.setattr(se, 'split_points', lambda file, duration: [0.0, 300.0, 600.0])
+    source = Path(tmp_path, 'news', 'clip.mxf')
+    source.parent.mkdir()
+    source.write_bytes(b'0' * 100)
+    work_dir = Path(tmp_path, 'news', '.clip.segments')
+    work_dir.mkdir()
+    rows = se.register(source, work_dir, '-c:v libx264', '-c:a aac', 900, 7)
+    assert [(x['number'], x['kind'], x.get('start'), x.get('length')) for x in rows] == \
+        [(0, 'video', 0.0, 300.0), (1, 'video', 300.0, 300.0), (2, 'video', 600.0, 0), (3, 'audio', None, None)]
+    assert all('status' not in x for x in rows)
+    # rows of the item are replaced in one transaction
+    assert [x[0].split(' ')[0] for x in sql.statements] == ['BEGIN', 'DELETE', 'INSERT', 'COMMIT']
+
+    Path(work_dir, 'seg_0000.mov').write_bytes(b'0')
+    Path(work_dir, 'audio.mov').write_bytes(b'0')
+    monkeypatch.setattr(se, 'split_points', lambda file, duration: 1 / 0)
+    rows = se.register(source, work_dir, '-c:v libx264', '-c:a aac', 900, 7)
+    assert [x['status'] for x in rows] == ['done', 'new', 'new', 'done']
+
+    # other options: the manifest does not match, segments are encoded again
+    monkeypatch.setattr(se, 'split_points', lambda file, duration: [0.0, 450.0])
+    rows = se.register(source, work_dir, '-c:v libx264 -crf 20', '-c:a aac', 900, 7)
+    assert len(rows) == 3 and all('status' not in x for x in rows)
+    assert sorted(x.name for x in work_dir.iterdir()) == ['manifest.json']
@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.strategy import AUDIO, ENCODE, REMUX, Strategy
+
+
+class FakeProbe:
+    def __init__(self, streams, bit_rate=None):
+        self.data = {'streams': streams, 'format': {'bit_rate': bit_rate}} if streams else {}
+
+    def get(self, file):
+        return self.data
+
+    def streams(self, file, codec_type):
+        return [x for x in self.data.get('streams', list()) if x['codec_type'] == codec_type]
+
+
+def video(codec, bit_rate=None, profile='High'):
+    return dict(codec_type='video', codec_name=codec, profile=profile, bit_rate=bit_rate)
+
+
+def audio(codec='aac', channels=2):
+    return dict(codec_type='audio', codec_name=codec, channels=channels)
+
+
+def decide(streams, bit_rate=None, **kwargs):
+    c = SimpleNamespace(RemuxCodecs=['h264', 'hevc'], RemuxAudioCodecs=['aac'], RemuxCodecMaxRate=25000,
+                        RemuxAnyMaxRate=8000)
+    c.__dict__.update(kwargs)
+    return Strategy(c, FakeProbe(streams, bit_rate)).decide('clip.mp4')
+
+
+@pytest.mark.parametrize('streams, bit_rate, result', [
+    ([video('h264', '10000000'), audio()], None, REMUX),
+    ([video('h264', '10000000'), audio('pcm_s24le')], None, AUDIO),
+    ([video('h264', '50000000'), audio()], None, ENCODE),  # XAVC-like bitrate
+    ([video('h264', '10000000', 'High 4:2:2 Intra'), audio()], None, ENCODE),
+    ([video('mpeg2video'), audio()], '6000000', REMUX),  # already below remux_any_max_kbps
+    ([video('mpeg2video'), audio()], '50000000', ENCODE),
+    ([video('dnxhd', '120000000'), audio()], None, ENCODE),
+    ([video('h264', '10000000')], None, REMUX),  # no audio
+    ([video('h264', '10000000')] + [audio(channels=1)] * 4, None, REMUX),
+    ([video('h264', '10000000')] + [audio(channels=2)] * 2, None, AUDIO),
+    ([video('h264', '10000000'), video('h264', '10000000'), audio()], None, ENCODE),
+    ([], None, ENCODE),  # probe failed
+])
+def test_decide(streams, bit_rate, result):
+    assert decide(streams, bit_rate) == result
+
+
+def test_unknown_bitrate_is_not_copied_without_codec_match():
+    assert decide([video('mpeg2video'), audio()]) == ENCODE
+    assert decide([video('h264'), audio()], RemuxCodecMaxRate=0) == REMUX
+    assert decide([video('mpeg2video'), audio()], '1000000', RemuxAnyMaxRate=0) == ENCODE
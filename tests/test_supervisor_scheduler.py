@@ -0,0 +1,103 @@
+import threading
+import xmlrpc.client
+from types import SimpleNamespace
+from xmlrpc.server import SimpleXMLRPCServer
+
+import pytest
+
+from app.supervisor_scheduler import Scheduler, Supervisor, connect, helpers_wanted
+
+HELPERS = ['helper_mode_{:02d}'.format(n) for n in range(4)]
+
+
+class FakeSupervisord:
+    # stand-in for the supervisor namespace of supervisord XML-RPC
+    def __init__(self):
+        self.states = {('main_mode', 'main_mode'): 'STOPPED'}
+        self.states.update({('helper_mode', x): 'STOPPED' for x in HELPERS})
+        self.signals = list()
+        self.already_started = set()
+
+    def getAllProcessInfo(self):
+        return [dict(group=group, name=name, statename=state) for (group, name), state in self.states.items()]
+
+    def startProcess(self, name, wait=True):
+        key = tuple(name.split(':'))
+        if self.states[key] == 'RUNNING' or name in self.already_started:
+            raise xmlrpc.client.Fault(60, 'ALREADY_STARTED: {}'.format(name))
+        self.states[key] = 'RUNNING'
+        return True
+
+    def signalProcess(self, name, signal):
+        # a drained helper stays RUNNING until its encode is finished
+        self.signals.append((name, signal))
+        return True
+
+
+@pytest.fixture
+def supervisord():
+    fake = FakeSupervisord()
+    server = SimpleXMLRPCServer(('127.0.0.1', 0), logRequests=False, allow_none=True)
+    for method in ('getAllProcessInfo', 'startProcess', 'signalProcess'):
+        server.register_function(getattr(fake, method), 'supervisor.' + method)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = 'http://127.0.0.1:{}/RPC2'.format(server.server_address[1])
+    yield fake, Supervisor(connect(url))
+    server.shutdown()
+    server.server_close()
+
+
+def conf(**kwargs):
+    c = SimpleNamespace(HelpersMin=0, HelpersMax=4, ItemsPerHelper=10, LoadLow=0.7, LoadHigh=1.5,
+                        HelperProgram='helper_mode', MainProgram='main_mode', WindowStart='22:00', WindowEnd='',
+                        HelperDelay=10, ScaleInterval=60)
+    c.__dict__.update(kwargs)
+    return c
+
+
+def running(fake):
+    return sorted(name for (group, name), state in fake.states.items()
+                  if group == 'helper_mode' and state == 'RUNNING')
+
+
+def test_tick_starts_main_and_scales_helpers_up(supervisord):
+    fake, supervisor = supervisord
+    scheduler = Scheduler(conf(), supervisor, depth=lambda c: 25, load=lambda: 0.1)
+    scheduler.tick(scheduler.helper_fire)
+    assert fake.states[('main_mode', 'main_mode')] == 'RUNNING'
+    assert running(fake) == HELPERS[:3]
+
+
+def test_overload_drains_one_more_helper_each_tick(supervisord):
+    fake, supervisor = supervisord
+    for name in HELPERS:
+        fake.states[('helper_mode', name)] = 'RUNNING'
+    scheduler = Scheduler(conf(HelpersMin=1), supervisor, depth=lambda c: 100, load=lambda: 2.0)
+    for _ in range(5):
+        scheduler.scale()
+    drained = [name for name, signal in fake.signals]
+    assert all(signal == 'USR1' for name, signal in fake.signals)
+    assert sorted(drained) == ['helper_mode:' + x for x in HELPERS[1:]]
+    # a drained helper that exited may be started again
+    fake.states[('helper_mode', HELPERS[3])] = 'EXITED'
+    scheduler.scale(2)
+    assert 'helper_mode:' + HELPERS[3] not in scheduler.drained
+
+
+def test_already_started_counts_as_started(supervisord):
+    fake, supervisor = supervisord
+    fake.already_started.add('helper_mode:' + HELPERS[0])
+    assert supervisor.start('helper_mode:' + HELPERS[0])
+    assert supervisor.start('helper_mode:' + HELPERS[1])
+    assert fake.states[('helper_mode', HELPERS[1])] == 'RUNNING'
+
+
+def test_helpers_wanted():
+    c = conf(HelpersMin=1)
+    assert helpers_wanted(35, 0, 0.1, c) == 4
+    assert helpers_wanted(5, 3, 0.1, c) == 3  # short queue never drains
+    assert helpers_wanted(None, 2, 0.1, c) == 2
+    assert helpers_wanted(100, 2, 1.0, c) == 2  # busy node does not grow
+    assert helpers_wanted(100, 3, 2.0, c) == 2
+    assert helpers_wanted(100, 1, 2.0, c) == 1